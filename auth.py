@@ -0,0 +1,120 @@
+import asyncio
+import json
+import re
+from typing import Optional
+
+import cache
+from constants import AUTH_CACHE_NAME, AUTH_CACHE_TTL, AUTH_TOKEN_OVERLAP
+
+# "auth_token": "<json string>", string may contain escaped quotes and slashes
+AUTH_TOKEN_PATTERN = re.compile(rb'"auth_token"\s*:\s*"((?:[^"\\]|\\.)*)"')
+
+
+class AuthState:
+    '''
+    Class holding LiveJournal session cookies and `auth_token`,
+    shared between downloads of several journals in one run
+    and persisted in cache between runs for `AUTH_CACHE_TTL` seconds.\n
+    `lock` makes concurrent downloads wait for a single handshake instead of doing their own.
+    '''
+
+    def __init__(self) -> None:
+        self.cookies: Optional[dict] = None
+        self.auth_token: Optional[str] = None
+        self.lock = asyncio.Lock()
+
+
+    def load(self) -> bool:
+        'Load cookies and `auth_token` from cache. Return `False` if cache is missing or expired.'
+        data, fresh = cache.load(AUTH_CACHE_NAME, AUTH_CACHE_TTL)
+        if not fresh or not isinstance(data, dict):
+            return False
+        if not data.get('cookies') or not data.get('auth_token'):
+            return False
+
+        self.cookies = data['cookies']
+        self.auth_token = data['auth_token']
+        return True
+
+
+    def save(self) -> None:
+        'Store cookies and `auth_token` in cache. Failures are ignored, handshake will be made next run.'
+        try:
+            cache.dump(AUTH_CACHE_NAME, {'cookies': self.cookies, 'auth_token': self.auth_token})
+        except OSError:
+            pass
+
+
+    def invalidate(self, auth_token: Optional[str]) -> None:
+        '''
+        Forget cookies and rejected `auth_token` along with cache,
+        unless token was already replaced by another download.
+        '''
+        if self.auth_token != auth_token:
+            return
+
+        self.cookies = None
+        self.auth_token = None
+        try:
+            cache.remove(AUTH_CACHE_NAME)
+        except OSError:
+            pass
+
+
+class AuthTokenScanner:
+    '''
+    Class for finding `auth_token` in journal page bytes fed chunk by chunk as they arrive,
+    so page download can stop as soon as token is found.\n
+    Last `AUTH_TOKEN_OVERLAP` bytes of previous chunks are scanned again with the next one
+    to find token split between chunks. Fed chunks are kept for `find_auth_token_soup` fallback.
+    '''
+
+    def __init__(self) -> None:
+        self.chunks = []
+        self._tail = b''
+
+
+    def feed(self, chunk: bytes) -> Optional[str]:
+        'Scan next chunk of the page. Return `auth_token` string if found, otherwise `None`.'
+        self.chunks.append(chunk)
+        window = self._tail + chunk
+
+        match = AUTH_TOKEN_PATTERN.search(window)
+        if match:
+            return json.loads(b'"' + match.group(1) + b'"')
+
+        self._tail = window[-AUTH_TOKEN_OVERLAP:]
+        return None
+
+
+    @property
+    def data(self) -> bytes:
+        'Return all fed bytes.'
+        return b''.join(self.chunks)
+
+
+def find_auth_token_soup(html: str) -> Optional[str]:
+    '''
+    Extract all inline JS scripts from page html with BeautifulSoup
+    and search for `auth_token` string. Return `auth_token` string or `None`.\n
+    Slow, used as fallback when `AuthTokenScanner` fails, so `bs4` is imported only then.
+    '''
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(html, features='html.parser')
+    pattern = re.compile(r'{.+\"auth_token\":.+}')
+
+    for element in soup.find_all('script', attrs={'src': None}):
+        script = str(element)
+        if 'auth_token' not in script:
+            continue
+
+        match = pattern.search(script)
+        if match is None:
+            continue
+        try:
+            return json.loads(match.group())['auth_token']
+        except (ValueError, KeyError):
+            continue
+
+    return None
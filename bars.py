@@ -0,0 +1,34 @@
+from rich.filesize import decimal
+from rich.progress import (BarColumn, MofNCompleteColumn, Progress,
+                           ProgressColumn, Task, TaskProgressColumn,
+                           TextColumn, TimeRemainingColumn)
+from rich.text import Text
+
+
+class ByteSpeedColumn(ProgressColumn):
+    'Renders average download speed from `bytes` task field.'
+
+    def render(self, task: Task) -> Text:
+        size = task.fields.get('bytes', 0)
+        if not size or not task.elapsed:
+            return Text('?', style='progress.data.speed')
+        return Text(f'{decimal(int(size / task.elapsed))}/s', style='progress.data.speed')
+
+
+def make_bars() -> Progress:
+    'Return `rich` progress bars display.'
+    return Progress(
+        TextColumn("[progress.description]{task.description}"),
+        BarColumn(),
+        TaskProgressColumn(),
+        "•",
+        MofNCompleteColumn(),
+        "•",
+        ByteSpeedColumn(),
+        "•",
+        TextColumn("({task.fields[filename]})"),
+        "•",
+        TextColumn("{task.fields[limits]}"),
+        "•",
+        TimeRemainingColumn(elapsed_when_finished=True),
+    )
@@ -0,0 +1,78 @@
+import argparse
+import sys
+import timeit
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from auth import AuthTokenScanner, find_auth_token_soup
+from constants import CHUNK_SIZE
+
+parser = argparse.ArgumentParser(
+    description='Compare streaming `auth_token` scanner with BeautifulSoup parsing '
+                'on saved journal pages.'
+    )
+parser.add_argument(
+    'PAGE',
+    nargs='*',
+    help='Path to saved journal page html. Synthetic page is used if not specified.'
+    )
+parser.add_argument(
+    '-n',
+    '--number',
+    type=int,
+    default=20,
+    help='Number of runs for each page. Default: 20.'
+    )
+
+
+def synthetic_page(size: int = 512 * 1024) -> bytes:
+    'Return journal-like page of about `size` bytes with `auth_token` in a head script.'
+    head = (b'<html><head><script src="/lj.js"></script>'
+            b'<script>Site.page = {"remote":null,"auth_token":"sessionless:1680000000:/__api/::'
+            + b'0123456789abcdef' * 4 + b'","currentJournal":"username"};</script></head><body>')
+    entry = (b'<article class="entry"><h3><a href="https://username.livejournal.com/1.html">Entry</a>'
+             b'</h3><div class="entry-content"><p>' + b'Lorem ipsum dolor sit amet. ' * 20
+             + b'</p><script>LJ.pushData({"entry":1});</script></div></article>')
+    body = entry * (size // len(entry))
+    return head + body + b'</body></html>'
+
+
+def scan(page: bytes) -> tuple:
+    'Feed page to `AuthTokenScanner` in `CHUNK_SIZE` chunks. Return token and bytes read.'
+    scanner = AuthTokenScanner()
+    for offset in range(0, len(page), CHUNK_SIZE):
+        auth_token = scanner.feed(page[offset:offset + CHUNK_SIZE])
+        if auth_token is not None:
+            return auth_token, offset + CHUNK_SIZE
+    return None, len(page)
+
+
+def bench(name: str, page: bytes, number: int) -> None:
+    'Print timings of both extractors for given page.'
+    html = page.decode('utf-8', errors='replace')
+    token_scan, read = scan(page)
+    token_soup = find_auth_token_soup(html)
+
+    time_scan = min(timeit.repeat(lambda: scan(page), number=1, repeat=number))
+    time_soup = min(timeit.repeat(lambda: find_auth_token_soup(html), number=1, repeat=number))
+
+    print(f'{name}\n'
+          f'  size:     {len(page) / 1024:.0f} KiB, scanner read {min(read, len(page)) / 1024:.0f} KiB\n'
+          f'  tokens:   {"equal" if token_scan == token_soup else "DIFFERENT"}'
+          f'{"" if token_scan else " (scanner found nothing, fallback used)"}\n'
+          f'  scanner:  {time_scan * 1000:.3f} ms\n'
+          f'  soup:     {time_soup * 1000:.3f} ms\n'
+          f'  speedup:  {time_soup / time_scan:.0f}x\n')
+
+
+def main() -> None:
+    args = parser.parse_args()
+    if not args.PAGE:
+        bench('synthetic page', synthetic_page(), args.number)
+    for path in args.PAGE:
+        bench(path, Path(path).read_bytes(), args.number)
+
+
+if __name__ == '__main__':
+    main()
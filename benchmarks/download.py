@@ -0,0 +1,203 @@
+import argparse
+import asyncio
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Optional
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+import aiohttp
+
+import cache
+from constants import (CONCURRENCY_DEFAULT, RETRY_ATTEMPTS, UAS_BACKUP,
+                       UAS_CACHE_NAME, WORKERS_DEFAULT)
+from lj_dl_img import Ljdl
+
+parser = argparse.ArgumentParser(
+    description='Run `Ljdl.download_images` end to end against local mock LiveJournal server '
+                '(benchmarks/mock_server.py) and report throughput, peak RSS and time to first byte.'
+    )
+parser.add_argument('--albums', type=int, default=3, help='Number of albums. Default: 3.')
+parser.add_argument('--records', type=int, default=200, help='Number of records in each album. Default: 200.')
+parser.add_argument('--size', type=int, default=256 * 1024, help='Image size in bytes. Default: 262144.')
+parser.add_argument('--latency', type=float, default=0.0,
+                    help='Seconds added by server before each response. Default: 0.')
+parser.add_argument('--bandwidth', type=float, default=0.0,
+                    help='Bytes per second of each response body, 0 is unlimited. Default: 0.')
+parser.add_argument('--error-rate', type=float, default=0.0,
+                    help='Share of requests answered with 503. Default: 0.')
+parser.add_argument('--seed', type=int, default=1, help='Random seed of injected errors. Default: 1.')
+parser.add_argument('-c', '--concurrency', type=int, default=CONCURRENCY_DEFAULT,
+                    help=f'Download concurrency. Default: {CONCURRENCY_DEFAULT}.')
+parser.add_argument('-w', '--workers', type=int, default=WORKERS_DEFAULT,
+                    help=f'Download worker processes. Default: {WORKERS_DEFAULT}.')
+parser.add_argument('-r', '--retries', type=int, default=RETRY_ATTEMPTS,
+                    help=f'Attempts for each request. Default: {RETRY_ATTEMPTS}.')
+parser.add_argument('-n', '--repeat', type=int, default=1, help='Number of runs. Default: 1.')
+parser.add_argument('--json', action='store_true', help='Print results as JSON lines.')
+
+
+class BenchLjdl(Ljdl):
+    '''
+    `Ljdl` pointed to local mock server, recording time to first byte
+    of each image response and time of the first image response since start.
+    '''
+
+    def __init__(self, base_url: str, *args, **kwargs) -> None:
+        super().__init__('https://benchmark.livejournal.com', *args, **kwargs)
+        self.url = f'{base_url}/journal'
+        self.url_api = f'{base_url}/__api/'
+        self.url_auth = f'{base_url}/tools/endpoints/get_auth_js'
+        self.started = None
+        self.first_image = None
+        self.ttfb = []
+
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_request_start.append(self._on_request_start)
+        trace_config.on_request_end.append(self._on_request_end)
+        self.http.trace_configs.append(trace_config)
+
+
+    async def _on_request_start(self, session, ctx, params) -> None:
+        ctx.started = time.monotonic()
+
+
+    async def _on_request_end(self, session, ctx, params) -> None:
+        if '/img/' not in params.url.path:
+            return
+        now = time.monotonic()
+        self.ttfb.append(now - ctx.started)
+        if self.first_image is None:
+            self.first_image = now - self.started
+
+
+    async def download_images(self) -> None:
+        self.started = time.monotonic()
+        await super().download_images()
+
+
+def free_port() -> int:
+    'Return port number free to listen on localhost.'
+    with socket.socket() as sock:
+        sock.bind(('localhost', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(args: argparse.Namespace, port: int) -> subprocess.Popen:
+    'Start mock server in a separate process and wait until it accepts connections.'
+    server = subprocess.Popen([
+        sys.executable, str(Path(__file__).with_name('mock_server.py')),
+        '--port', str(port),
+        '--albums', str(args.albums),
+        '--records', str(args.records),
+        '--size', str(args.size),
+        '--latency', str(args.latency),
+        '--bandwidth', str(args.bandwidth),
+        '--error-rate', str(args.error_rate),
+        '--seed', str(args.seed),
+        ])
+
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('localhost', port), timeout=1).close()
+            return server
+        except OSError:
+            time.sleep(0.05)
+
+    server.kill()
+    raise RuntimeError('Mock server did not start in 10 seconds.')
+
+
+def peak_rss() -> Optional[int]:
+    'Return peak resident set size of this process in bytes, `None` if unsupported.'
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def run(args: argparse.Namespace, base_url: str) -> dict:
+    'Download all mock albums to temporary folder once. Return dict with results.'
+    with tempfile.TemporaryDirectory() as tmp:
+        # isolated cache: seeded user-agents, fresh auth handshake every run
+        os.environ['LJDL_CACHE_DIR'] = str(Path(tmp) / 'cache')
+        cache.dump(UAS_CACHE_NAME, list(UAS_BACKUP))
+
+        ljdl = BenchLjdl(
+            base_url,
+            path=str(Path(tmp) / 'download'),
+            concurrency=args.concurrency,
+            retries=args.retries,
+            workers=args.workers
+            )
+        asyncio.run(ljdl.download_images())
+        elapsed = time.monotonic() - ljdl.started
+
+    summary = ljdl.metrics.summary()
+    counters = {
+        (name, tuple(sorted(item['labels'].items()))): item['value']
+        for name, items in summary['counters'].items()
+        for item in items
+        }
+    downloaded = counters.get(('images_total', (('result', 'downloaded'),)), 0)
+    size = counters.get(('response_bytes_total', (('phase', 'download'),)), 0)
+    ttfb = sorted(ljdl.ttfb)
+    quantiles = statistics.quantiles(ttfb, n=100) if len(ttfb) > 1 else ttfb * 99
+
+    return {
+        'images': downloaded,
+        'failed': len(ljdl.failed),
+        'retries': ljdl.retry.retries,
+        'bytes': size,
+        'elapsed': round(elapsed, 3),
+        'mib_per_second': round(size / elapsed / 2 ** 20, 2),
+        'images_per_second': round(downloaded / elapsed, 1),
+        'first_image_ms': round(ljdl.first_image * 1000, 1) if ljdl.first_image else None,
+        'ttfb_p50_ms': round(quantiles[49] * 1000, 2) if ttfb else None,
+        'ttfb_p95_ms': round(quantiles[94] * 1000, 2) if ttfb else None,
+        'connection_reuse': summary['connection_reuse'],
+        'peak_rss_mib': round(peak_rss() / 2 ** 20, 1) if peak_rss() else None,
+        }
+
+
+def report(number: int, result: dict) -> None:
+    print(f"run {number}\n"
+          f"  images:       {result['images']} downloaded, {result['failed']} failed, "
+          f"{result['retries']} retries\n"
+          f"  elapsed:      {result['elapsed']:.3f} s\n"
+          f"  throughput:   {result['mib_per_second']} MiB/s, {result['images_per_second']} images/s\n"
+          f"  first image:  {result['first_image_ms']} ms after start\n"
+          f"  ttfb:         p50 {result['ttfb_p50_ms']} ms, p95 {result['ttfb_p95_ms']} ms\n"
+          f"  peak rss:     {result['peak_rss_mib']} MiB\n")
+
+
+def main() -> None:
+    args = parser.parse_args()
+    port = free_port()
+    server = start_server(args, port)
+    try:
+        for number in range(1, args.repeat + 1):
+            result = run(args, f'http://localhost:{port}')
+            if args.json:
+                print(json.dumps({'run': number, **result}))
+            else:
+                report(number, result)
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,178 @@
+import argparse
+import asyncio
+import json
+import random
+
+from aiohttp import web
+
+AUTH_TOKEN = 'sessionless:0:/__api/::benchmark'
+CHUNK = 16 * 1024
+
+parser = argparse.ArgumentParser(
+    description='Local stand-in for livejournal.com auth, journal page, JSON-RPC API '
+                'and image CDN, for offline benchmarks.'
+    )
+parser.add_argument('--port', type=int, default=8765, help='Port to listen on. Default: 8765.')
+parser.add_argument('--albums', type=int, default=3, help='Number of albums. Default: 3.')
+parser.add_argument('--records', type=int, default=200, help='Number of records in each album. Default: 200.')
+parser.add_argument('--size', type=int, default=256 * 1024, help='Image size in bytes. Default: 262144.')
+parser.add_argument('--latency', type=float, default=0.0,
+                    help='Seconds added before each response. Default: 0.')
+parser.add_argument('--bandwidth', type=float, default=0.0,
+                    help='Bytes per second of each response body, 0 is unlimited. Default: 0.')
+parser.add_argument('--error-rate', type=float, default=0.0,
+                    help='Share of requests answered with 503. Default: 0.')
+parser.add_argument('--seed', type=int, default=None, help='Random seed of injected errors.')
+
+
+class MockLiveJournal:
+    '''
+    Class for aiohttp application mimicking livejournal.com endpoints used by `Ljdl`:
+    `get_auth_js` with cookies, journal page with `auth_token`, `__api/` JSON-RPC
+    `photo.get_albums` and `photo.get_records` methods, and image CDN.\n
+    Latency, per-response bandwidth, error rate and album sizes are configurable.
+    Image urls point to `base_url`, since client sends `Host` header of livejournal.com.
+    '''
+
+    def __init__(
+        self,
+        albums: int = 3,
+        records: int = 200,
+        size: int = 256 * 1024,
+        latency: float = 0.0,
+        bandwidth: float = 0.0,
+        error_rate: float = 0.0,
+        seed: int = None,
+        base_url: str = 'http://localhost:8765') -> None:
+        self.base_url = base_url
+        self.albums = albums
+        self.records = records
+        self.size = size
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.image = bytes(range(256)) * (size // 256) + bytes(size % 256)
+        self.served = {'auth': 0, 'page': 0, 'api': 0, 'image': 0, 'error': 0}
+
+
+    def app(self) -> web.Application:
+        'Return aiohttp application with all routes.'
+        app = web.Application()
+        app.router.add_get('/tools/endpoints/get_auth_js', self.auth)
+        app.router.add_get('/journal', self.page)
+        app.router.add_post('/__api/', self.api)
+        app.router.add_get('/img/{album}/{index}.jpg', self.image_handler)
+        app.router.add_get('/stats', self.stats)
+        return app
+
+
+    async def _delay(self) -> bool:
+        'Sleep for configured latency. Return `True` if request should fail.'
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.error_rate and self.random.random() < self.error_rate:
+            self.served['error'] += 1
+            return True
+        return False
+
+
+    async def _send(self, request: web.Request, body: bytes, content_type: str) -> web.StreamResponse:
+        'Send body in chunks limited to configured bandwidth.'
+        response = web.StreamResponse(headers={'Content-Type': content_type, 'ETag': '"benchmark"'})
+        response.content_length = len(body)
+        await response.prepare(request)
+        for offset in range(0, len(body), CHUNK):
+            chunk = body[offset:offset + CHUNK]
+            await response.write(chunk)
+            if self.bandwidth:
+                await asyncio.sleep(len(chunk) / self.bandwidth)
+        await response.write_eof()
+        return response
+
+
+    async def auth(self, request: web.Request) -> web.Response:
+        'Return `ljuniq` in JSON and set `luid` cookie.'
+        self.served['auth'] += 1
+        if await self._delay():
+            return web.Response(status=503)
+        response = web.json_response({'ljuniq': 'benchmark'})
+        response.set_cookie('luid', 'benchmark')
+        return response
+
+
+    async def page(self, request: web.Request) -> web.StreamResponse:
+        'Return journal page with `auth_token` in head script.'
+        self.served['page'] += 1
+        if await self._delay():
+            return web.Response(status=503)
+        script = json.dumps({'remote': None, 'auth_token': AUTH_TOKEN})
+        html = f'<html><head><script>Site.page = {script};</script></head><body>{"x" * 100000}</body></html>'
+        return await self._send(request, html.encode(), 'text/html')
+
+
+    async def api(self, request: web.Request) -> web.Response:
+        'Answer batch of JSON-RPC calls.'
+        self.served['api'] += 1
+        if await self._delay():
+            return web.Response(status=503)
+
+        results = []
+        for call in await request.json():
+            params = call['params']
+            if params.get('auth_token') != AUTH_TOKEN:
+                results.append({'id': call['id'], 'jsonrpc': '2.0',
+                                'error': {'code': -32000, 'message': 'invalid auth_token'}})
+            elif call['method'] == 'photo.get_albums':
+                albums = [
+                    {'id': album, 'name': f'Album {album}', 'count': self.records,
+                     'timecreate': 1600000000 + album, 'security': 0, 'cover': None}
+                    for album in range(1, self.albums + 1)
+                    ]
+                results.append({'id': call['id'], 'jsonrpc': '2.0', 'result': {'albums': albums}})
+            elif call['method'] == 'photo.get_records':
+                album, offset = params['albumid'], params['offset']
+                records = [
+                    {'id': index, 'index': index, 'name': f'IMG_{index:05d}.JPG',
+                     'url': f'{self.base_url}/img/{album}/{index}.jpg',
+                     'timecreate': 1600000000 + index, 'description': '', 'tags': []}
+                    for index in range(offset, min(offset + params['limit'], self.records))
+                    ]
+                results.append({'id': call['id'], 'jsonrpc': '2.0', 'result': {'records': records}})
+            else:
+                results.append({'id': call['id'], 'jsonrpc': '2.0',
+                                'error': {'code': -32601, 'message': 'method not found'}})
+
+        return web.json_response(results)
+
+
+    async def image_handler(self, request: web.Request) -> web.StreamResponse:
+        'Return image body.'
+        self.served['image'] += 1
+        if await self._delay():
+            return web.Response(status=503)
+        return await self._send(request, self.image, 'image/jpeg')
+
+
+    async def stats(self, request: web.Request) -> web.Response:
+        'Return number of served requests and injected errors.'
+        return web.json_response(self.served)
+
+
+def main() -> None:
+    args = parser.parse_args()
+    mock = MockLiveJournal(
+        albums=args.albums,
+        records=args.records,
+        size=args.size,
+        latency=args.latency,
+        bandwidth=args.bandwidth,
+        error_rate=args.error_rate,
+        seed=args.seed,
+        base_url=f'http://localhost:{args.port}'
+        )
+    web.run_app(mock.app(), host='localhost', port=args.port, print=None)
+
+
+if __name__ == '__main__':
+    main()
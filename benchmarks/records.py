@@ -0,0 +1,153 @@
+import argparse
+import importlib.util
+import json
+import sys
+import timeit
+import tracemalloc
+from pathlib import Path
+from typing import Callable
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from constants import RECORDS_BATCH_SIZE, RECORDS_PAGE_SIZE
+from records import Record, decode_json, get_suffix
+
+parser = argparse.ArgumentParser(
+    description='Measure memory per album record and parsing throughput of `photo.get_records` '
+                'batch responses: text json with record dicts vs bytes `decode_json` with `Record` objects.'
+    )
+parser.add_argument(
+    '--records',
+    type=int,
+    default=200000,
+    help='Number of records kept in memory for memory measurement. Default: 200000.'
+    )
+parser.add_argument(
+    '-n',
+    '--number',
+    type=int,
+    default=10,
+    help='Number of runs for each timing. Default: 10.'
+    )
+
+
+def synthetic_record(index: int) -> dict:
+    'Return record dict shaped like `photo.get_records` response item.'
+    url = f'https://ic.pics.livejournal.com/username/1234567/{1000000 + index}/{1000000 + index}_original.jpg'
+    return {
+        'id': 1000000 + index,
+        'index': index,
+        'name': f'IMG_{index:05d}.JPG',
+        'url': url,
+        'preview_url': url.replace('_original', '_600'),
+        'url_preview': url.replace('_original', '_300'),
+        'width': 4000,
+        'height': 3000,
+        'filesize': 2500000 + index,
+        'timecreate': 1680000000 + index,
+        'timeupdate': 1680000000 + index,
+        'description': '',
+        'tags': [],
+        'security': 'public',
+        'albumid': 1234567,
+        'migrated_info': {'migrated': 1, 'source': 'scrapbook'},
+        }
+
+
+def synthetic_response() -> bytes:
+    'Return batch response body with `RECORDS_BATCH_SIZE` full pages of records.'
+    response = [
+        {'id': call_id, 'jsonrpc': '2.0', 'result': {'records': [
+            synthetic_record(page * RECORDS_PAGE_SIZE + index) for index in range(RECORDS_PAGE_SIZE)
+            ]}}
+        for call_id, page in enumerate(range(RECORDS_BATCH_SIZE), 1)
+        ]
+    return json.dumps(response).encode()
+
+
+def decode_text(body: bytes) -> list:
+    'Previous decoding: response body decoded to text first, parsed with standard json.'
+    return json.loads(body.decode())
+
+
+def make_records(response: list) -> list:
+    'Make `Record` objects from decoded response, as `Ljdl._get_records` does.'
+    return [[Record.from_dict(record) for record in call['result']['records']] for call in response]
+
+
+def image_name_path(record: dict) -> str:
+    'Previous `Ljdl._get_image_name` with `Path` suffixes.'
+    name = record['name']
+    url_ext = Path(record['url']).suffix
+    record_ext = Path(name).suffix
+    if record_ext.isupper():
+        name = record_ext.lower().join(name.rsplit(record_ext, 1))
+    if not name.endswith(('.jpg', '.jpeg', '.gif', '.png')):
+        name = ''.join((name, url_ext))
+    if name.endswith('.jpeg'):
+        name = '.jpg'.join(name.rsplit('.jpeg', 1))
+    return f"{record['index']}__{name.replace(' ', '_')}"
+
+
+def image_name_str(record: Record) -> str:
+    'Current `Ljdl._get_image_name` with string suffixes.'
+    name = record.name
+    url_ext = get_suffix(record.url)
+    record_ext = get_suffix(name)
+    if record_ext.isupper():
+        name = record_ext.lower().join(name.rsplit(record_ext, 1))
+    if not name.endswith(('.jpg', '.jpeg', '.gif', '.png')):
+        name = ''.join((name, url_ext))
+    if name.endswith('.jpeg'):
+        name = '.jpg'.join(name.rsplit('.jpeg', 1))
+    return f"{record.index}__{name.replace(' ', '_')}"
+
+
+def measure_memory(make: Callable, count: int) -> float:
+    'Return bytes allocated per item by list of `count` items made with `make`.'
+    tracemalloc.start()
+    items = [make(index) for index in range(count)]
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del items
+    return size / count
+
+
+def main() -> None:
+    args = parser.parse_args()
+    body = synthetic_response()
+    count = RECORDS_BATCH_SIZE * RECORDS_PAGE_SIZE
+
+    response = decode_json(body)
+    time_text = min(timeit.repeat(lambda: decode_text(body), number=1, repeat=args.number))
+    time_bytes = min(timeit.repeat(lambda: decode_json(body), number=1, repeat=args.number))
+    time_records = min(timeit.repeat(lambda: make_records(response), number=1, repeat=args.number))
+
+    dicts = [record for call in response for record in call['result']['records']]
+    records = [record for page in make_records(response) for record in page]
+    names_equal = all(image_name_path(d) == image_name_str(r) for d, r in zip(dicts, records))
+    time_path = min(timeit.repeat(lambda: [image_name_path(d) for d in dicts], number=1, repeat=args.number))
+    time_str = min(timeit.repeat(lambda: [image_name_str(r) for r in records], number=1, repeat=args.number))
+
+    memory_dicts = measure_memory(synthetic_record, args.records)
+    memory_records = measure_memory(lambda index: Record.from_dict(synthetic_record(index)), args.records)
+
+    print(f'batch response: {len(body) / 1024:.0f} KiB, {count} records, '
+          f"decoder: {'orjson' if importlib.util.find_spec('orjson') else 'json'}\n"
+          f'parse\n'
+          f'  json text:            {count / time_text:>10,.0f} records/s\n'
+          f'  decode_json bytes:    {count / time_bytes:>10,.0f} records/s\n'
+          f'  speedup:              {time_text / time_bytes:.1f}x\n'
+          f'  Record.from_dict:     {count / time_records:>10,.0f} records/s\n'
+          f'image names ({"equal" if names_equal else "DIFFERENT"})\n'
+          f'  Path suffix:          {count / time_path:>10,.0f} records/s\n'
+          f'  string suffix:        {count / time_str:>10,.0f} records/s\n'
+          f'  speedup:              {time_path / time_str:.1f}x\n'
+          f'memory per record ({args.records} records kept)\n'
+          f'  dict:                 {memory_dicts:>10,.0f} bytes\n'
+          f'  Record:               {memory_records:>10,.0f} bytes\n'
+          f'  reduction:            {memory_dicts / memory_records:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+import cache
+from constants import JOURNALS_DEFAULT, UAS_BACKUP, UAS_CACHE_NAME
+from download import free_port, start_server
+
+# child process: cli run with all endpoints pointed to mock server
+CHILD = '''
+import sys
+sys.argv = ['lj_dl_img.py', '-q', *{argv!r}]
+import lj_dl_img
+
+class BenchLjdl(lj_dl_img.Ljdl):
+    url_api = {base!r} + '/__api/'
+    url_auth = {base!r} + '/tools/endpoints/get_auth_js'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.url = {base!r} + '/journal'
+
+lj_dl_img.Ljdl = BenchLjdl
+if __name__ == '__main__':
+    lj_dl_img.main()
+'''
+
+parser = argparse.ArgumentParser(
+    description='Compare nightly-style run of one lj_dl_img.py process per journal '
+                'with the same journals sent as jobs to `--serve` service, '
+                'against local mock LiveJournal server (benchmarks/mock_server.py).'
+    )
+parser.add_argument('-n', '--count', type=int, default=20, help='Number of journals. Default: 20.')
+parser.add_argument('--albums', type=int, default=1, help='Number of albums in each journal. Default: 1.')
+parser.add_argument('--records', type=int, default=20, help='Number of records in each album. Default: 20.')
+parser.add_argument('--size', type=int, default=64 * 1024, help='Image size in bytes. Default: 65536.')
+parser.add_argument('--latency', type=float, default=0.02,
+                    help='Seconds added by server before each response. Default: 0.02.')
+parser.add_argument('-j', '--journals', type=int, default=JOURNALS_DEFAULT,
+                    help=f'Jobs run by service at once. Default: {JOURNALS_DEFAULT}.')
+
+
+def child(base_url: str, argv: list[str], **kwargs) -> subprocess.Popen:
+    'Start cli with given arguments, pointed to mock server.'
+    return subprocess.Popen(
+        [sys.executable, '-c', CHILD.format(base=base_url, argv=argv)],
+        cwd=ROOT, stdout=subprocess.DEVNULL, **kwargs
+        )
+
+
+def request(url: str, data: dict = None) -> dict:
+    'Make request to service API, POST `data` if given. Return JSON response.'
+    body = json.dumps(data).encode() if data is not None else None
+    with urllib.request.urlopen(url, body, timeout=10) as response:
+        return json.load(response)
+
+
+def per_process(args: argparse.Namespace, base_url: str, tmp: Path) -> float:
+    'Download all journals one by one, one process each. Return seconds taken.'
+    started = time.perf_counter()
+    for number in range(args.count):
+        child(base_url, ['-d', str(tmp / 'process'), f'https://journal{number}.livejournal.com']).wait()
+    return time.perf_counter() - started
+
+
+def service(args: argparse.Namespace, base_url: str, tmp: Path) -> float:
+    '''
+    Start service, wait until it listens, then send all journals as jobs
+    and wait until they are done. Return seconds taken by jobs only.
+    '''
+    port = free_port()
+    api = f'http://localhost:{port}'
+    server = child(base_url, ['-d', str(tmp / 'service'), '-j', str(args.journals), '--serve', f'localhost:{port}'])
+    try:
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                request(f'{api}/stats')
+                break
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise RuntimeError('Service did not start in 30 seconds.')
+                time.sleep(0.05)
+
+        started = time.perf_counter()
+        for number in range(args.count):
+            request(f'{api}/jobs', {'url': f'https://journal{number}.livejournal.com'})
+        while request(f'{api}/stats')['jobs'].get('done', 0) < args.count:
+            time.sleep(0.01)
+        return time.perf_counter() - started
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main() -> None:
+    args = parser.parse_args()
+    port = free_port()
+    base_url = f'http://localhost:{port}'
+    mock = start_server(argparse.Namespace(**vars(args), bandwidth=0.0, error_rate=0.0, seed=1), port)
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            tmp = Path(tmp)
+            # isolated cache: seeded user-agents, auth handshake is cached by the first run
+            os.environ['LJDL_CACHE_DIR'] = str(tmp / 'cache')
+            cache.dump(UAS_CACHE_NAME, list(UAS_BACKUP))
+
+            images = args.count * args.albums * args.records
+            for name, run in (('process per journal', per_process), ('service', service)):
+                elapsed = run(args, base_url, tmp)
+                print(f'{name:<20} {elapsed:7.2f} s, {args.count / elapsed:6.1f} journals/s, '
+                      f'{images / elapsed:7.1f} images/s')
+    finally:
+        mock.terminate()
+        mock.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+import cache
+from constants import UAS_BACKUP, UAS_CACHE_NAME
+
+# child process: whole cli run with auth endpoint pointed to local socket
+CHILD = '''
+import sys
+sys.argv = ['lj_dl_img.py', '-q', '-d', {path!r}, 'https://benchmark.livejournal.com']
+import lj_dl_img
+lj_dl_img.Ljdl.url_auth = {url!r}
+lj_dl_img.main()
+'''
+
+parser = argparse.ArgumentParser(
+    description='Measure cold start of lj_dl_img.py: import time of its modules (`-X importtime`), '
+                '`--version` run time and time from process start to the first request.'
+    )
+parser.add_argument(
+    '-n',
+    '--number',
+    type=int,
+    default=10,
+    help='Number of runs for each measurement. Default: 10.'
+    )
+parser.add_argument(
+    '--top',
+    type=int,
+    default=10,
+    help='Number of slowest imports to show. Default: 10.'
+    )
+
+
+def import_times() -> list[tuple[str, int, int]]:
+    '''
+    Import `lj_dl_img` in a fresh interpreter with `-X importtime`.
+    Return list of `(module, nesting depth, cumulative us)` tuples.
+    '''
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import lj_dl_img'],
+        cwd=ROOT, capture_output=True, text=True, check=True
+        )
+    times = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        _, cumulative, module = line[len('import time:'):].split('|')
+        name = module.strip()
+        depth = (len(module.rstrip()) - len(name) - 1) // 2
+        times.append((name, depth, int(cumulative)))
+    return times
+
+
+def version_time() -> float:
+    'Return seconds taken by `lj_dl_img.py --version` run.'
+    started = time.perf_counter()
+    subprocess.run(
+        [sys.executable, 'lj_dl_img.py', '--version'],
+        cwd=ROOT, stdout=subprocess.DEVNULL, check=True
+        )
+    return time.perf_counter() - started
+
+
+def first_request_time(tmp: Path) -> float:
+    '''
+    Return seconds from start of cli run to its first connection,
+    accepted by plain socket in place of auth endpoint. Run is killed then.
+    '''
+    with socket.socket() as server:
+        server.bind(('localhost', 0))
+        server.listen()
+        server.settimeout(30)
+        url = f'http://localhost:{server.getsockname()[1]}/tools/endpoints/get_auth_js'
+        code = CHILD.format(path=str(tmp / 'download'), url=url)
+
+        started = time.perf_counter()
+        child = subprocess.Popen(
+            [sys.executable, '-c', code],
+            cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+            )
+        try:
+            connection, _ = server.accept()
+            elapsed = time.perf_counter() - started
+            connection.close()
+        finally:
+            child.kill()
+            child.wait()
+    return elapsed
+
+
+def report(name: str, timings: list[float]) -> None:
+    print(f'  {name:<15} min {min(timings) * 1000:7.1f} ms, median {statistics.median(timings) * 1000:7.1f} ms')
+
+
+def main() -> None:
+    args = parser.parse_args()
+
+    runs = [import_times() for _ in range(args.number)]
+    totals = [next(cumulative for module, _, cumulative in times if module == 'lj_dl_img') / 1e6
+              for times in runs]
+    # slowest modules imported by lj_dl_img directly, from the fastest run
+    fastest = runs[totals.index(min(totals))]
+    direct = [item for item in fastest if item[1] == 1]
+    direct.sort(key=lambda item: item[2], reverse=True)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        # isolated cache: seeded user-agents, so no background refresh, fresh auth handshake
+        os.environ['LJDL_CACHE_DIR'] = str(tmp / 'cache')
+        cache.dump(UAS_CACHE_NAME, list(UAS_BACKUP))
+
+        versions = [version_time() for _ in range(args.number)]
+        requests = [first_request_time(tmp) for _ in range(args.number)]
+
+    print('startup')
+    report('import', totals)
+    report('--version', versions)
+    report('first request', requests)
+    print('\nslowest imports of lj_dl_img, cumulative')
+    for module, _, cumulative in direct[:args.top]:
+        print(f'  {module:<24} {cumulative / 1000:7.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
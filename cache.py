@@ -0,0 +1,62 @@
+import json
+import os
+import sys
+import time
+from pathlib import Path
+from typing import Optional, Sequence
+
+
+def get_cache_dir() -> Path:
+    '''
+    Return Path object with per-user cache folder of the script.\n
+    Follows platform conventions, can be overridden with `LJDL_CACHE_DIR` environment variable.
+    '''
+    override = os.environ.get('LJDL_CACHE_DIR')
+    if override:
+        return Path(override)
+
+    if sys.platform == 'win32':
+        base = os.environ.get('LOCALAPPDATA') or Path.home() / 'AppData' / 'Local'
+    elif sys.platform == 'darwin':
+        base = Path.home() / 'Library' / 'Caches'
+    else:
+        base = os.environ.get('XDG_CACHE_HOME') or Path.home() / '.cache'
+
+    return Path(base) / 'dmitrymeshkoff' / 'lj-dl-img'
+
+
+def load(name: str, ttl: Optional[float] = None) -> tuple[Optional[Sequence], bool]:
+    '''
+    Load cached json file by `name`.\n
+    Return tuple with data (`None` if file is missing or broken) and
+    `True` if data is younger than `ttl` seconds, otherwise `False`.
+    '''
+    path = get_cache_dir() / name
+    try:
+        with open(path, 'r', encoding='UTF-8') as file:
+            data = json.load(file)
+        age = time.time() - path.stat().st_mtime
+    except (OSError, ValueError):
+        return None, False
+
+    return data, ttl is None or age < ttl
+
+
+def remove(name: str) -> None:
+    'Remove cached file by `name` if it exists.'
+    try:
+        (get_cache_dir() / name).unlink()
+    except FileNotFoundError:
+        pass
+
+
+def dump(name: str, data: Sequence) -> None:
+    'Atomically dump any sequence `data` to cached json file by `name`.'
+    cache_dir = get_cache_dir()
+    cache_dir.mkdir(parents=True, exist_ok=True)
+
+    path = cache_dir / name
+    part_path = path.with_name(f'{path.name}.part')
+    with open(part_path, 'w', encoding='UTF-8') as file:
+        json.dump(data, file, ensure_ascii=False)
+    os.replace(part_path, path)
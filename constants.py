@@ -1,11 +1,77 @@
 VERSION = '2023.03.27'
 
 
+URL_SITE = 'https://www.livejournal.com'
 URL_API = 'https://www.livejournal.com/__api/'
 URL_AUTH = 'https://www.livejournal.com/tools/endpoints/get_auth_js'
 URL_UAS = 'https://www.whatismybrowser.com/guides/the-latest-user-agent/'
 
 
+UAS_CACHE_NAME = 'user_agents.json'
+UAS_CACHE_TTL = 7 * 24 * 60 * 60
+AUTH_CACHE_NAME = 'auth.json'
+AUTH_CACHE_TTL = 24 * 60 * 60
+
+
+CONCURRENCY_DEFAULT = 5
+JOURNALS_DEFAULT = 3
+SERVE_ADDRESS_DEFAULT = '127.0.0.1:8787'
+# finished jobs kept for status requests, older ones are forgotten
+SERVE_JOBS_KEEP = 1000
+LIMIT_PER_HOST_DEFAULT = 5
+CHUNK_SIZE = 64 * 1024
+KEEPALIVE_TIMEOUT = 30
+DNS_CACHE_TTL = 300
+RECORDS_PAGE_SIZE = 100
+# photo.get_records calls (album pages) packed into one JSON-RPC batch request
+RECORDS_BATCH_SIZE = 20
+AUTH_TOKEN_OVERLAP = 1024
+STATE_COMMIT_EVERY = 100
+VARIANTS = ('original', 'preview')
+VARIANT_DEFAULT = 'original'
+# record fields with preview url, tried in order before original url is rewritten:
+# pics.livejournal.com keeps resized copies next to original, <id>_original.jpg -> <id>_600.jpg
+RECORD_PREVIEW_KEYS = ('preview_url', 'url_preview', 'thumbnail_url')
+PREVIEW_SIZE = 600
+# record fields with original image size in bytes, tried in order
+RECORD_SIZE_KEYS = ('filesize', 'file_size', 'size')
+PROGRESS_INTERVAL = 0.1
+JSON_PROGRESS_INTERVAL = 1.0
+
+
+# ioctl request code for copy-on-write file clone on Linux
+FICLONE = 0x40049409
+# fallocate mode flag on Linux: allocate blocks without changing file size
+FALLOC_FL_KEEP_SIZE = 0x01
+WRITER_THREADS = 4
+# chunks coalesced per writer thread call, with one more buffer being written
+# a download holds at most two of them
+WRITE_BUFFER_SIZE = 2 * CHUNK_SIZE
+WORKERS_DEFAULT = 1
+WORKER_BATCH_SIZE = 50
+WORKER_POLL_INTERVAL = 1.0
+SOCK_CONNECT_TIMEOUT = 30
+SOCK_READ_TIMEOUT = 60
+
+
+RETRY_ATTEMPTS = 5
+RETRY_BACKOFF = 1.0
+RETRY_BACKOFF_MAX = 60.0
+RETRY_STATUSES = (408, 429, 500, 502, 503, 504)
+
+
+API_RATE_LIMIT = 5.0
+RATE_LIMIT_DEFAULT = 0.0
+RATE_LIMIT_BURST = 5
+AIMD_LATENCY_FACTOR = 3.0
+AIMD_COOLDOWN = 2.0
+
+
+# histogram bucket upper bounds: request latency in seconds and queue depth in items
+METRICS_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+METRICS_DEPTH_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
 UAS_BACKUP = (
     "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/107.0.0.0 Safari/537.36",
     "Mozilla/5.0 (Windows NT 10.0; WOW64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/107.0.0.0 Safari/537.36",
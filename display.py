@@ -0,0 +1,165 @@
+import json
+import sys
+import time
+from types import TracebackType
+from typing import TYPE_CHECKING, Callable, Optional, Type, Union
+
+from constants import JSON_PROGRESS_INTERVAL, PROGRESS_INTERVAL
+
+if TYPE_CHECKING:
+    from rich.progress import Progress
+
+
+class QuietProgress:
+    'Class with `rich.progress.Progress` interface used by `Ljdl`, which renders nothing.'
+
+    def __init__(self) -> None:
+        self._next_id = 0
+
+
+    def __enter__(self) -> 'QuietProgress':
+        return self
+
+
+    def __exit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc: Optional[BaseException],
+        tb: Optional[TracebackType]) -> None:
+        pass
+
+
+    def add_task(self, description: str, total: Optional[float] = None, **fields) -> int:
+        'Return id of new task.'
+        self._next_id += 1
+        return self._next_id
+
+
+    def update(self, task_id: int, **kwargs) -> None:
+        pass
+
+
+class JsonProgress(QuietProgress):
+    '''
+    Class with `rich.progress.Progress` interface used by `Ljdl`, which prints
+    task state as one JSON object per line to stdout, for headless runs.\n
+    Each task is printed when its description changes and
+    at most once in `JSON_PROGRESS_INTERVAL` seconds otherwise.
+    '''
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.tasks = {}
+
+
+    def add_task(self, description: str, total: Optional[float] = None, **fields) -> int:
+        task_id = super().add_task(description, total)
+        self.tasks[task_id] = {
+            'description': description,
+            'completed': 0,
+            'total': total,
+            'bytes': 0,
+            'filename': '',
+            'started': time.monotonic(),
+            'printed': 0.0
+            }
+        self._print(task_id, force=True)
+        return task_id
+
+
+    def update(
+        self,
+        task_id: int,
+        description: Optional[str] = None,
+        total: Optional[float] = None,
+        advance: Optional[float] = None,
+        **fields) -> None:
+        task = self.tasks[task_id]
+        force = description is not None and description != task['description']
+        if description is not None:
+            task['description'] = description
+        if total is not None:
+            task['total'] = total
+        if advance:
+            task['completed'] += advance
+        if 'bytes' in fields:
+            task['bytes'] = fields['bytes']
+        if 'filename' in fields:
+            task['filename'] = fields['filename'].strip()
+        self._print(task_id, force)
+
+
+    def _print(self, task_id: int, force: bool = False) -> None:
+        task = self.tasks[task_id]
+        now = time.monotonic()
+        if not force and now - task['printed'] < JSON_PROGRESS_INTERVAL:
+            return
+
+        task['printed'] = now
+        line = {key: value for key, value in task.items() if key not in ('started', 'printed')}
+        line['elapsed'] = round(now - task['started'], 3)
+        sys.stdout.write(f'{json.dumps(line, ensure_ascii=False)}\n')
+        sys.stdout.flush()
+
+
+def make_progress(mode: str = 'rich') -> Union['Progress', JsonProgress, QuietProgress]:
+    '''
+    Return progress display: `rich` progress bars, `json` lines or `quiet` for no output.
+    `rich` is imported only when bars are shown.
+    '''
+    if mode == 'quiet':
+        return QuietProgress()
+    if mode == 'json':
+        return JsonProgress()
+
+    from bars import make_bars
+    return make_bars()
+
+
+class ProgressTracker:
+    '''
+    Class for batched updates of a single progress task.\n
+    Completed images and downloaded bytes are accumulated and passed to progress display
+    at most once in `PROGRESS_INTERVAL` seconds, along with the last image name
+    and current limits, which are formatted only then.
+    '''
+
+    def __init__(
+        self,
+        progress: Union['Progress', JsonProgress, QuietProgress],
+        task_id: int,
+        format_filename: Callable[[str], str],
+        get_limits: Callable[[], str]) -> None:
+        self.progress = progress
+        self.task_id = task_id
+        self.format_filename = format_filename
+        self.get_limits = get_limits
+        self.bytes = 0
+        self._advance = 0
+        self._filename = None
+        self._flushed = time.monotonic()
+
+
+    def add_bytes(self, size: int) -> None:
+        'Add downloaded bytes.'
+        self.bytes += size
+
+
+    def advance(self, filename: Optional[str] = None) -> None:
+        'Count one completed image, optionally with its name to display.'
+        self._advance += 1
+        if filename is not None:
+            self._filename = filename
+        if time.monotonic() - self._flushed >= PROGRESS_INTERVAL:
+            self.flush()
+
+
+    def flush(self) -> None:
+        'Pass accumulated changes to progress display.'
+        fields = {'bytes': self.bytes, 'limits': self.get_limits()}
+        if self._filename is not None:
+            fields['filename'] = self.format_filename(self._filename)
+        self.progress.update(self.task_id, advance=self._advance, **fields)
+        self._advance = 0
+        self._filename = None
+        self._flushed = time.monotonic()
@@ -0,0 +1,13 @@
+class LjdlError(Exception):
+    'Base class of errors raised by `Ljdl`, catch it to handle any of them.'
+
+
+class ConfigError(LjdlError, ValueError):
+    '''
+    Raised when `Ljdl` is given invalid url, limit, variant, download path or store,
+    or download service is given address it can't listen on.
+    '''
+
+
+class BatchError(LjdlError):
+    'Raised by `download_batch` after all journals are done if download of any of them failed.'
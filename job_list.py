@@ -0,0 +1,88 @@
+import json
+import os
+from pathlib import Path
+from types import TracebackType
+from typing import Optional, Type
+
+
+class JobListWriter:
+    '''
+    Class for writing job list json file incrementally, album by album and record by record.\n
+    Output has the same structure as whole job list dumped with `json.dump`,
+    it is written to `.part` file and renamed to given path on close,
+    so previous job list stays intact until the new one is complete.
+    '''
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.part_path = path.with_name(f'{path.name}.part')
+        self._file = None
+        self._album_open = False
+        self._first_album = True
+        self._first_record = True
+
+
+    def __enter__(self) -> 'JobListWriter':
+        self.open()
+        return self
+
+
+    def __exit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc: Optional[BaseException],
+        tb: Optional[TracebackType]) -> None:
+        self.close()
+
+
+    def _dumps(self, data: object) -> str:
+        return json.dumps(data, ensure_ascii=False)
+
+
+    def open(self) -> None:
+        'Open `.part` file and write job list header.'
+        self._file = open(self.part_path, 'w', encoding='UTF-8')
+        self._file.write('{\n    "albums": [')
+
+
+    def add_album(self, album: dict) -> None:
+        'Close previous album and start new one, records are added with `add_record`.'
+        self._close_album()
+
+        self._file.write('\n        {' if self._first_album else ',\n        {')
+        for key, value in album.items():
+            if key != 'records':
+                self._file.write(f'\n            {self._dumps(key)}: {self._dumps(value)},')
+        self._file.write('\n            "records": {')
+
+        self._album_open = True
+        self._first_album = False
+        self._first_record = True
+
+
+    def add_record(self, name: str, url: str) -> None:
+        'Add record to current album.'
+        self._file.write('\n' if self._first_record else ',\n')
+        self._file.write(f'                {self._dumps(name)}: {self._dumps(url)}')
+        self._first_record = False
+
+
+    def _close_album(self) -> None:
+        if not self._album_open:
+            return
+        self._file.write('}' if self._first_record else '\n            }')
+        self._file.write('\n        }')
+        self._album_open = False
+
+
+    def close(self) -> None:
+        'Write job list footer and rename `.part` file to job list path.'
+        if self._file is None:
+            return
+
+        self._close_album()
+        self._file.write(']' if self._first_album else '\n    ]')
+        self._file.write('\n}')
+        self._file.close()
+        self._file = None
+        os.replace(self.part_path, self.path)
@@ -1,103 +1,218 @@
-import argparse
 import asyncio
+import contextlib
+import hashlib
 import json
 import os
 import re
 import sys
+import time
+from collections import Counter, deque
 from math import floor
 from pathlib import Path
-from typing import List, Optional, Sequence
+from types import TracebackType
+from typing import (TYPE_CHECKING, AsyncIterator, List, NamedTuple, Optional,
+                    Sequence, Type)
 from urllib.parse import urlparse
 
-import aiofiles
-import aiohttp
-from bs4 import BeautifulSoup
-from rich.console import Console
-from rich.progress import (BarColumn, MofNCompleteColumn, Progress, TaskID,
-                           TaskProgressColumn, TextColumn, TimeRemainingColumn)
-
-from constants import (RESPONSE_NOT_200, UAS_BACKUP, URL_API, URL_AUTH,
-                       VERSION, TermColors, headers_default)
+from auth import AuthState, AuthTokenScanner, find_auth_token_soup
+from constants import (API_RATE_LIMIT, CHUNK_SIZE, CONCURRENCY_DEFAULT,
+                       JOURNALS_DEFAULT, LIMIT_PER_HOST_DEFAULT, PREVIEW_SIZE,
+                       RATE_LIMIT_DEFAULT, RECORDS_BATCH_SIZE,
+                       RECORDS_PAGE_SIZE, RETRY_ATTEMPTS, RETRY_STATUSES,
+                       SERVE_ADDRESS_DEFAULT, UAS_BACKUP, URL_API, URL_AUTH,
+                       URL_SITE, VARIANT_DEFAULT, VARIANTS, VERSION,
+                       WORKER_BATCH_SIZE, WORKERS_DEFAULT, TermColors,
+                       headers_default)
+from display import (JsonProgress, ProgressTracker, QuietProgress,
+                     make_progress)
+from errors import BatchError, ConfigError, LjdlError
+from metrics import Metrics
+from ratelimit import AimdController, HostRateLimiter
+from records import Album, Record, decode_json, get_suffix
+from retry import ApiError, ResponseStatusError, RetryPolicy, check_status
+from session import SessionManager
+from state import StateStore
+from store import ContentStore
 from user_agents import Ua
+from workers import WorkerError, WorkerPool
+from writer import DiskWriter
+
+if TYPE_CHECKING:
+    import argparse
+
+    from rich.progress import Progress
 
-parser = argparse.ArgumentParser(
-    description='LJDL - Download image albums from livejournal.com.\n\n'
-                'Usage: lj-dl-img [OPTIONS] [URL]',
-    formatter_class=argparse.RawTextHelpFormatter,
-    add_help=False
-    )
-
-parser.add_argument(
-    'URL',
-    type=str,
-    help='URL of Livejournal user or certain album to download. For example, specify: \n'
-         'https://username.livejournal.com - to download all avaliable albums.\n'
-         'https://username.livejournal.com/photo/album/1337 - to download just one certain album.\n\n'
-    )
-
-parser.add_argument(
-    '-h',
-    '--help',
-    action='help',
-    default=argparse.SUPPRESS,
-    help='Show this help message and exit.\n\n'
-    )
-
-parser.add_argument(
-    '-v',
-    '--version',
-    action='version',
-    version=VERSION,
-    help='Show script version and exit.\n\n'
-    )
-
-parser.add_argument(
-    '-d',
-    '--directory',
-    type=str,
-    metavar='',
-    help='Path where images should be downloaded.\n'
-         'Note that script will create a subfolder for each downloaded album.\n'
-         'Default: current working directory.\n\n'
-    )
-
-args = parser.parse_args()
-
-progress = Progress(
-    TextColumn("[progress.description]{task.description}"),
-    BarColumn(),
-    TaskProgressColumn(),
-    "•",
-    MofNCompleteColumn(),
-    "•",
-    TextColumn("({task.fields[filename]})"),
-    "•",
-    TimeRemainingColumn(elapsed_when_finished=True),
-)
+# progress display, made in `main` or on first `download_batch`
+progress = None
+
+
+class DownloadResult(NamedTuple):
+    '''
+    Result of a single image yielded by `Ljdl.iter_downloads`.\n
+    `status` is one of `downloaded`, `not_modified`, `skipped` (downloaded before, sync mode),
+    `linked` (placed from content store) or `failed` with `error` set.
+    `size` is count of bytes received, `duration` is seconds spent on download including retries.
+    '''
+    album_id: int
+    name: str
+    url: str
+    path: Path
+    status: str
+    size: int = 0
+    duration: float = 0.0
+    error: Optional[Exception] = None
 
 
 class Ljdl():
     '''Class for downloading photo albums from livejournal.com'''
 
-    def __init__(self, url: str, path: Optional[str] = None) -> None:
-        self.console = Console()
+    # endpoints may be overridden in subclasses, e.g. to run against local mock server
+    url_api = URL_API
+    url_auth = URL_AUTH
+
+    def __init__(
+        self,
+        url: str,
+        path: Optional[str] = None,
+        concurrency: int = CONCURRENCY_DEFAULT,
+        limit_per_host: int = LIMIT_PER_HOST_DEFAULT,
+        sync: bool = False,
+        retries: int = RETRY_ATTEMPTS,
+        rate_limit: float = RATE_LIMIT_DEFAULT,
+        store: Optional[str] = None,
+        fsync: bool = False,
+        workers: int = WORKERS_DEFAULT,
+        variant: str = VARIANT_DEFAULT,
+        largest_first: bool = False,
+        verbose: bool = True,
+        share_with: Optional['Ljdl'] = None) -> None:
+        '''
+        Pass another instance as `share_with` to reuse its session, worker pool, auth state,
+        user-agent, rate limits and concurrency budget, other limits are ignored then.
+        Pass `verbose=False` to print nothing. Invalid arguments raise `ConfigError`.
+        '''
+        self.verbose = verbose
         self.colors = TermColors
         self.error_mark = f'{self.colors.FAIL}●{self.colors.ENDC}'
         self.url = url
         self.url_parse = self._validate_url(url)
         self.goal_is_multiple = self._goal_is_multiple()
         self.download_path = self._set_download_path(path)
-        self.user_agent = Ua.random()
         self.username = self._get_username()
-        self.cookies = None
-        self.auth_token = None
+        self.label = ''
+        self.concurrency = self._validate_limit(concurrency, 'concurrency')
+        self.limit_per_host = self._validate_limit(limit_per_host, 'limit-per-host')
+        self.failed = []
+        self.sync = sync
+        self.state = None
+        self.tracker = None
+        self.workers = self._validate_limit(workers, 'workers')
+        self.pool = None
+        self.variant = self._validate_variant(variant)
+        self.largest_first = largest_first
+        self.retry = RetryPolicy(attempts=self._validate_limit(retries, 'retries'))
+        self.results = None
+        self._resources = None
+        self._entered = 0
+
+        if share_with is None:
+            self._owner = self
+            # state databases opened by running downloads, by path
+            self._states = {}
+            self._state_users = Counter()
+            self._state_lock = asyncio.Lock()
+            self.metrics = Metrics()
+            with self.metrics.phase('ua'):
+                self.user_agent = Ua.random()
+            self.auth = AuthState()
+            self.api_limiter = HostRateLimiter(API_RATE_LIMIT)
+            self.image_limiter = HostRateLimiter(max(0.0, rate_limit))
+            self.aimd = AimdController(maximum=self.concurrency)
+            self.http = SessionManager(
+                limit=self.concurrency,
+                limit_per_host=self.limit_per_host,
+                trace_configs=[self.metrics.trace_config()]
+                )
+            self.store = self._set_store(store)
+            self.writer = DiskWriter(fsync=fsync)
+            if self.workers > 1:
+                self.pool = WorkerPool(self.workers, self._worker_options())
+        else:
+            self._owner = share_with._owner
+            self.metrics = share_with.metrics
+            self.user_agent = share_with.user_agent
+            self.auth = share_with.auth
+            self.api_limiter = share_with.api_limiter
+            self.image_limiter = share_with.image_limiter
+            self.aimd = share_with.aimd
+            self.http = share_with.http
+            self.store = share_with.store
+            self.writer = share_with.writer
+            self.pool = share_with.pool
+
+
+    async def __aenter__(self) -> 'Ljdl':
+        '''
+        Open session, worker pool, content store and disk writer, which are kept open
+        for all downloads of this instance and of instances made with `share_with`.
+        Instances made with `share_with` enter their owner, resources are closed
+        when the last of nested or concurrent `async with` blocks exits, and opened again on next enter.
+        '''
+        owner = self._owner
+        if owner._entered == 0:
+            async with contextlib.AsyncExitStack() as resources:
+                await resources.enter_async_context(owner.http)
+                if owner.pool is not None:
+                    await resources.enter_async_context(owner.pool)
+                if owner.store is not None:
+                    owner.store.open()
+                owner._resources = resources.pop_all()
+        owner._entered += 1
+        return self
+
+
+    async def __aexit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc: Optional[BaseException],
+        tb: Optional[TracebackType]) -> None:
+        owner = self._owner
+        owner._entered -= 1
+        if owner._entered:
+            return
+
+        resources, owner._resources = owner._resources, None
+        try:
+            await resources.__aexit__(exc_type, exc, tb)
+        finally:
+            if owner.store is not None:
+                owner.store.close()
+            owner.writer.close()
+
+
+    @property
+    def cookies(self) -> Optional[dict]:
+        return self.auth.cookies
+
 
+    @property
+    def auth_token(self) -> Optional[str]:
+        return self.auth.auth_token
 
-    def _exit(self, message: str, status: int = 0):
-        'Gracefully exit with status code and message to stderr.'
-        if status != 0:
-            sys.stderr.write(f'{self.error_mark} {message}')
-        raise SystemExit(status)
+
+    def _echo(self, message: str, error: bool = False) -> None:
+        '''
+        Print message to stdout, or to stderr if `error` or stdout is taken
+        by `--json-progress` lines, unless instance is not `verbose`.
+        '''
+        if not self.verbose:
+            return
+        if error:
+            sys.stderr.write(message)
+        elif isinstance(progress, JsonProgress):
+            sys.stderr.write(f'{message}\n')
+        else:
+            print(message)
 
 
     def _validate_url(self, url:str) -> object:
@@ -109,21 +224,45 @@ class Ljdl():
                    'https://username.livejournal.com')
         try:
             url_parse = urlparse(url)
-        except ValueError:
-            self._exit(message, 1)
+        except ValueError as ex:
+            raise ConfigError(message) from ex
 
         if not all((url_parse.scheme, url_parse.netloc)):
-            self._exit(message, 1)
+            raise ConfigError(message)
         if 'livejournal.com' not in url_parse.netloc:
-            self._exit('Only downloading from https://www.livejournal.com is supported.', 1)
+            raise ConfigError('Only downloading from https://www.livejournal.com is supported.')
 
         pattern = re.compile(r'^https:\/\/([a-z0-9_\-])+\.livejournal\.com')
         if not pattern.search(url):
-            self._exit('Not a valid username, please check URL spelling.', 1)
+            raise ConfigError('Not a valid username, please check URL spelling.')
 
         return url_parse
 
 
+    def _validate_limit(self, value: int, name: str) -> int:
+        'Check if given connection limit is a positive integer. Return it unchanged.'
+        if value < 1:
+            raise ConfigError(f"'{name}' must be a positive integer, got {value}.")
+        return value
+
+
+    def _validate_variant(self, variant: str) -> str:
+        'Check if given image variant is supported. Return it unchanged.'
+        if variant not in VARIANTS:
+            raise ConfigError(f"'variant' must be one of: {', '.join(VARIANTS)}, got '{variant}'.")
+        return variant
+
+
+    def _set_store(self, path: Optional[str] = None) -> Optional[ContentStore]:
+        'Open content-addressed store at given path. Return `None` if path is not specified.'
+        if not path:
+            return None
+        try:
+            return ContentStore(Path(path))
+        except Exception as e:
+            raise ConfigError(f'Can\'t open store at given path.\nException: {e}') from e
+
+
     def _goal_is_multiple(self) -> bool:
         'Return `True` if download goal is multiple albums, otherwise `False`.'
         if not self.url_parse.path:
@@ -133,8 +272,8 @@ class Ljdl():
             if pattern.search(self.url_parse.path):
                 return False
             else:
-                print('URL doesn\'t contain specific album id, '
-                      'downloading all available albums...')
+                self._echo('URL doesn\'t contain specific album id, '
+                           'downloading all available albums...')
                 return True
 
 
@@ -162,26 +301,28 @@ class Ljdl():
                 try:
                     download_path.mkdir(parents=True)
                 except Exception as e:
-                    self._exit(message.format(reason = f'created.\nException: {e}\n\n'), 1)
+                    raise ConfigError(message.format(reason = f'created.\nException: {e}\n\n')) from e
 
             if not download_path.is_dir():
-                self._exit(message.format(reason = 'a folder.\n'), 1)
+                raise ConfigError(message.format(reason = 'a folder.\n'))
             if not os.access(download_path, os.W_OK):
-                self._exit(message.format(reason = 'writable.\n'), 1)
+                raise ConfigError(message.format(reason = 'writable.\n'))
 
         return download_path
 
 
-    async def _get_cookies(self, session: aiohttp.ClientSession) -> dict:
-        'Make request by given `URL_AUTH` url and return `RequestsCookieJar` object from response.'
-        async with session.get(url=URL_AUTH) as response:
-            assert response.status == 200, f'{self.error_mark} {RESPONSE_NOT_200}'
-            json_text = json.loads(await response.text())
+    async def _get_cookies(self, headers: dict) -> dict:
+        'Make request by given `url_auth` url and return `RequestsCookieJar` object from response.'
+        async with self.http.get(url=self.url_auth, headers=headers, trace_request_ctx={'phase': 'auth'}) as response:
+            check_status(response)
+            json_text = decode_json(await response.read())
 
-        assert 'ljuniq' in json_text, f"{self.error_mark} Can\'t get 'ljuniq' cookie, exiting."
+        if not isinstance(json_text, dict) or 'ljuniq' not in json_text:
+            raise ApiError("Can't get 'ljuniq' cookie.")
 
-        cookie_jar = str(session.cookie_jar.filter_cookies(f"{URL_AUTH.rsplit('/', 3 )[0]}"))
-        assert len(cookie_jar) > 0, f"{self.error_mark} Can\'t get 'luid' cookie, exiting."
+        cookie_jar = str(self.http.session.cookie_jar.filter_cookies(f"{self.url_auth.rsplit('/', 3 )[0]}"))
+        if not cookie_jar:
+            raise ApiError("Can't get 'luid' cookie.")
 
         cookie_dict = {
             'luid':
@@ -193,48 +334,97 @@ class Ljdl():
         return cookie_dict
 
 
-    async def _get_auth_token(self, session: aiohttp.ClientSession) -> str:
+    async def _get_auth_token(self, headers: dict) -> str:
         '''
-        Extract all inline JS scripts from `_get_html` response text
-        and search for `auth_token` string. Return `auth_token` string.
+        Scan journal page bytes for `auth_token` string as they arrive
+        and stop reading the page once it is found. Return `auth_token` string.\n
+        If it isn't found, parse whole page inline JS scripts as a fallback.
         '''
-        async with session.get(url=self.url) as response:
-            assert response.status == 200, f'{self.error_mark} {RESPONSE_NOT_200}'
-            html = await response.text()
-
-        soup = BeautifulSoup(html, features='html.parser')
-        scripts = list(soup.find_all('script', attrs={'src':None}))
-
-        for element in scripts:
-            if 'auth_token' in str(element):
-                script = str(element)
-
-        assert script != None, f"{self.error_mark} Can\'t find any 'auth_token' string\
-        in page scripts, exiting."
-
-        pattern = re.compile(r'{.+\"auth_token\":.+}')
-        match = pattern.search(script).group()
-        auth_token = json.loads(match)['auth_token']
+        scanner = AuthTokenScanner()
+
+        async with self.http.get(
+                url=self.url,
+                headers=headers,
+                cookies=self.cookies,
+                trace_request_ctx={'phase': 'auth'}) as response:
+            check_status(response)
+            async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                self.metrics.inc('response_bytes_total', len(chunk), phase='auth')
+                auth_token = scanner.feed(chunk)
+                if auth_token is not None:
+                    return auth_token
+
+            html = scanner.data.decode(response.get_encoding(), errors='replace')
+
+        auth_token = find_auth_token_soup(html)
+        if auth_token is None:
+            raise ApiError("Can't find any 'auth_token' string in page scripts.")
 
         return auth_token
 
 
     async def _auth(self) -> None:
+        '''
+        Get session cookies and `auth_token` from cache,
+        or make a handshake unless another download already did it.
+        '''
         headers = dict(headers_default)
         del headers['Origin'], headers['Referer']
         headers['User-Agent'] = self.user_agent
 
-        async with aiohttp.ClientSession(headers=headers) as session:
-            self.cookies = await self._get_cookies(session)
+        async with self.auth.lock:
+            if self.auth.cookies is None and self.auth.auth_token is None and self.auth.load():
+                return
+
+            handshake = False
+            if self.auth.cookies is None:
+                self.auth.cookies = await self.retry.run(self._get_cookies, headers)
+                handshake = True
+            if self.auth.auth_token is None:
+                self.auth.auth_token = await self.retry.run(self._get_auth_token, headers)
+                handshake = True
+
+            if handshake:
+                self.auth.save()
+
+
+    def _get_rpc_result(self, response_json: list[dict], key: str) -> object:
+        'Return `key` field of JSON-RPC result from response, raise `ApiError` on error.'
+        for _dict in response_json:
+            if 'error' in _dict:
+                raise ApiError(f"API responded with error: {_dict['error']}")
+            try:
+                return _dict['result'][key]
+            except (KeyError, TypeError):
+                continue
+
+        raise ApiError(f"Can't find '{key}' key in JSON response.")
+
+
+    def _get_rpc_results(self, response_json: list[dict], key: str, ids: Sequence[int]) -> list:
+        '''
+        Return `key` fields of JSON-RPC batch results in order of given call `ids`,
+        results may come in any order. Raise `ApiError` on error or missing result.
+        '''
+        results = {}
+        for _dict in response_json:
+            if 'error' in _dict:
+                raise ApiError(f"API responded with error: {_dict['error']}")
+            try:
+                results[_dict['id']] = _dict['result'][key]
+            except (KeyError, TypeError):
+                continue
 
-        async with aiohttp.ClientSession(headers=headers, cookies=self.cookies) as session:
-            self.auth_token = await self._get_auth_token(session)
+        missing = [call_id for call_id in ids if call_id not in results]
+        if missing:
+            raise ApiError(f"Can't find '{key}' key in JSON response for calls {missing}.")
+        return [results[call_id] for call_id in ids]
 
 
-    async def _get_albums(self) -> list[dict]:
+    async def _get_albums(self) -> list[Album]:
         '''
         Make jsonrpc request to API to get albums info.
-        Return list of dict with albums info.
+        Return list of `Album` objects.
         '''
         headers = dict(headers_default)
         del headers['Upgrade-Insecure-Requests']
@@ -256,36 +446,32 @@ class Ljdl():
 
         payload_dump = json.dumps(payload)
 
-        async with aiohttp.ClientSession(headers=headers, cookies=self.cookies) as session:
-            async with session.post(url=URL_API, data=payload_dump) as response:
-                assert response.status == 200, f'{self.error_mark} {RESPONSE_NOT_200}'
-                response_json = json.loads(await response.text())
-
-        for _dict in response_json:
-            try:
-                albums = _dict['result']['albums']
-            except KeyError:
-                continue
+        await self.api_limiter.acquire(self.url_api)
+        async with self.http.post(
+                url=self.url_api,
+                data=payload_dump,
+                headers=headers,
+                cookies=self.cookies,
+                trace_request_ctx={'phase': 'albums'}) as response:
+            check_status(response)
+            response_json = decode_json(await response.read())
 
-        assert albums != None, f"{self.error_mark} Can\'t find 'albums' \
-        key in JSON response, exiting."
+        albums = [Album.from_dict(album) for album in self._get_rpc_result(response_json, 'albums')]
 
         if self.goal_is_multiple:
             return albums
         else:
             for album in albums:
-                if album['id'] == self._get_album_id():
+                if album.id == self._get_album_id():
                     return [album]
+            raise ApiError(f"Can't find album {self._get_album_id()} in '{self.username}' journal.")
 
 
-    async def _get_records(
-        self,
-        session: aiohttp.ClientSession,
-        album_id: int,
-        limit: int) -> list[dict]:
+    async def _get_records(self, pages: Sequence[tuple[int, int]]) -> list[list[Record]]:
         '''
-        Make jsonrpc request to API to get specific album records.
-        Return dict with image file names as keys and urls as values.
+        Make single jsonrpc batch request to API to get several pages of album records,
+        one `photo.get_records` call for each `(album_id, offset)` in `pages`.
+        Return list of `Record` lists in order of `pages`.
         '''
         headers = dict(headers_default)
         del headers['Upgrade-Insecure-Requests']
@@ -293,7 +479,7 @@ class Ljdl():
         headers['Accept'] = 'application/json, text/javascript, */*; q=0.01'
         origin = ''.join((self.url_parse.scheme, '://', self.url_parse.netloc))
         headers['Origin'] = origin
-        headers['Referer'] = ''.join((origin, '/photo', f'/album/{str(album_id)}'))
+        headers['Referer'] = ''.join((origin, '/photo'))
         headers['User-Agent'] = self.user_agent
         payload = [{
             "jsonrpc":"2.0",
@@ -301,123 +487,325 @@ class Ljdl():
             "params":{
                 "albumid":album_id,
                 "user":f"{self.username}",
-                "offset":0,
-                "limit":limit,
+                "offset":offset,
+                "limit":RECORDS_PAGE_SIZE,
                 "sort":"timecreate",
                 "order":"desc",
                 "migrated_info":1,
                 "auth_token":f"{self.auth_token}"
                 },
-            "id":7
-            }]
+            "id":call_id
+            } for call_id, (album_id, offset) in enumerate(pages, 1)]
 
         payload_dump = json.dumps(payload)
 
-        async with session.post(url=URL_API, data=payload_dump) as response:
-            assert response.status == 200, f'{self.error_mark} {RESPONSE_NOT_200}'
-            response_json = json.loads(await response.text())
+        await self.api_limiter.acquire(self.url_api)
+        async with self.http.post(
+                url=self.url_api,
+                data=payload_dump,
+                headers=headers,
+                cookies=self.cookies,
+                trace_request_ctx={'phase': 'records'}) as response:
+            check_status(response)
+            response_json = decode_json(await response.read())
 
-        for _dict in response_json:
-            try:
-                records_json = response_json[0]['result']['records']
-            except KeyError:
-                continue
+        results = self._get_rpc_results(response_json, 'records', range(1, len(pages) + 1))
+        return [[Record.from_dict(record) for record in records] for records in results]
 
-        assert records_json != None, f"{self.error_mark} Can\'t find 'records' \
-        key in JSON response, exiting"
 
-        records = {}
-        records[album_id] = {}
+    def _get_image_name(self, record: Record) -> str:
+        '''
+        Return normalized image file name of the record:
+        lowercase known extension, extension taken from url if missing, `index` prefix.
+        '''
+        name = record.name
         possible_exts = ('.jpg', '.jpeg', '.gif', '.png')
 
-        for record in records_json:
-            url_ext = Path(record['url']).suffix
-            record_ext = Path(record['name']).suffix
-
-            if record_ext.isupper():
-                record['name'] = record_ext.lower().join(record['name'].rsplit(record_ext, 1))
+        url_ext = get_suffix(record.url)
+        record_ext = get_suffix(name)
 
-            if not record['name'].endswith(possible_exts):
-                record['name'] = ''.join((record['name'], url_ext))
+        if record_ext.isupper():
+            name = record_ext.lower().join(name.rsplit(record_ext, 1))
 
-            if record['name'].endswith('.jpeg'):
-                record['name'] = '.jpg'.join(record['name'].rsplit('.jpeg', 1))
+        if not name.endswith(possible_exts):
+            name = ''.join((name, url_ext))
 
-            # add 'index' field to result file name to avoid overwriting files with same original file name
-            # plus: it will be possible to sort them in a folder
-            image_name = f"{record['index']}__{record['name'].replace(' ', '_')}"
-            image_url = f"{record['url']}"
-            records[album_id][image_name] = image_url
+        if name.endswith('.jpeg'):
+            name = '.jpg'.join(name.rsplit('.jpeg', 1))
 
-        return records
+        # add 'index' field to result file name to avoid overwriting files with same original file name
+        # plus: it will be possible to sort them in a folder
+        return f"{record.index}__{name.replace(' ', '_')}"
 
 
-    async def _generate_job_list(self) -> List[dict[dict]]:
+    def _get_record_url(self, record: Record) -> str:
         '''
-        Return combined results of `_get_albums` and `_get_records` as a list of dicts.
+        Return url of the record image variant. Preview url is taken from record
+        or made from original url on pics.livejournal.com, falls back to original.
         '''
-        with self.console.status('Generating Job List...', spinner='dots'):
-            await self._auth()
-            albums = await self._get_albums()
+        if self.variant == 'original':
+            return record.url
+        if record.preview_url:
+            return record.preview_url
 
-            job_list = {'albums': []}
-            keys_to_keep = ('count', 'timecreate', 'name', 'id')
-            for album in albums:
-                # create a shallow copy to avoid
-                # "RuntimeError: dictionary changed size during iteration"
-                for _key in album.copy():
-                    if _key not in keys_to_keep:
-                        del album[f'{_key}']
-                job_list['albums'].append(album)
+        return re.sub(r'_original(\.\w+)$', rf'_{PREVIEW_SIZE}\1', record.url)
 
 
-            async with aiohttp.ClientSession(cookies=self.cookies) as session:
-                tasks = []
-                results = {}
-                for album in job_list['albums']:
-                    tasks.append(asyncio.create_task(self._get_records(
-                        session=session,
-                        album_id=album['id'],
-                        limit=album['count']
-                        )))
-                done, _ = await asyncio.wait(tasks)
-                for task in done:
-                    results.update(task.result())
+    def _get_record_size(self, record: Record) -> tuple[Optional[int], Optional[int]]:
+        '''
+        Return tuple with expected image size in bytes and pixels count of the record,
+        `None` if unknown. Size in bytes is known for original variant only.
+        '''
+        return record.size if self.variant == 'original' else None, record.pixels
 
 
-            albums_total = len(job_list['albums'])
-            records_total = 0
-            for album in job_list['albums']:
-                album['records'] = results[album['id']]
-                records_total += album['count']
+    async def _generate_job_list(self) -> List[Album]:
+        '''
+        Return albums from `_get_albums`,
+        records are enumerated later by download pipeline.
+        '''
+        with self.metrics.phase('auth'):
+            await self._auth()
+        auth_token = self.auth_token
+        try:
+            with self.metrics.phase('albums'):
+                albums = await self.retry.run(self._get_albums)
+        except (ApiError, ResponseStatusError) as ex:
+            if isinstance(ex, ResponseStatusError) and ex.status not in (401, 403):
+                raise
+            # cached or shared credentials may be expired or issued for another journal,
+            # make fresh handshake with this journal page and try once again
+            self.auth.invalidate(auth_token)
+            with self.metrics.phase('auth'):
+                await self._auth()
+            with self.metrics.phase('albums'):
+                albums = await self.retry.run(self._get_albums)
+
+        albums_total = len(albums)
+        records_total = sum(album.count for album in albums)
 
-        print(f"Found total {self.colors.OK_GREEN}{records_total}{self.colors.ENDC} "
-              f"images in {self.colors.OK_GREEN}{albums_total}{self.colors.ENDC} "
-              f"album{'s' if albums_total > 1 else ''}.")
+        self._echo(f"{self.label}Found total {self.colors.OK_GREEN}{records_total}{self.colors.ENDC} "
+                   f"images in {self.colors.OK_GREEN}{albums_total}{self.colors.ENDC} "
+                   f"album{'s' if albums_total > 1 else ''}.")
 
-        return job_list
+        return albums
 
 
     async def _fetch_image(
         self,
-        session: aiohttp.ClientSession,
         url: str,
         path: Path,
-        task_id: TaskID,
-        filename: str) -> None:
+        sync: bool) -> Optional[dict]:
+        '''
+        Stream image from given url to `.part` file next to specified path
+        in `CHUNK_SIZE` chunks and rename it to `path` once download completes.
+        In `sync` mode request is conditional on stored validator and `.part` file is resumed.
+        Return dict with image `size` and `digest`, `None` if image is not modified.\n
+        Request is rate limited per host and gated by adaptive concurrency limit,
+        latency of successful responses and throttling (`RETRY_STATUSES` responses
+        and timeouts) are fed back to `self.aimd`, other errors are ignored by it.\n
+        Resumed `.part` file answered with 416 is complete if its size is the image size
+        from `Content-Range: bytes */<size>`, otherwise it's removed and image is downloaded again.
+        '''
+        info = None
+        restart = False
+        part_path = path.with_name(f'{path.name}.part')
+        headers, offset = {}, 0
+        if sync:
+            validator = self.state.get_validator(url)
+            headers, offset = await self.writer.run(self._get_sync_headers, validator, path, part_path)
+
+        await self.image_limiter.acquire(url)
+        async with self.aimd:
+            started = time.monotonic()
+            try:
+                async with self.http.get(url, headers=headers, trace_request_ctx={'phase': 'download'}) as response:
+                    expected = (200, 206, 304)
+                    if response.status in expected:
+                        self.aimd.on_success(time.monotonic() - started)
+                    elif response.status in RETRY_STATUSES:
+                        self.aimd.on_throttle()
+
+                    if response.status == 416 and offset:
+                        if response.headers.get('Content-Range', '') == f'bytes */{offset}':
+                            info = await self._finish_part(url, path, part_path, offset)
+                        else:
+                            await self.writer.run(part_path.unlink, True)
+                            restart = True
+                    else:
+                        check_status(response, expected)
+                        if response.status != 304:
+                            info = await self._write_image(response, url, path, part_path, offset)
+            except asyncio.TimeoutError:
+                self.aimd.on_throttle()
+                raise
+
+        if restart:
+            return await self._fetch_image(url, path, sync)
+        return info
+
+
+    async def _write_image(
+        self,
+        response: object,
+        url: str,
+        path: Path,
+        part_path: Path,
+        offset: int) -> dict:
+        '''
+        Stream response body to `part_path`, appending if resumed from `offset`, and rename it to `path`.
+        With content store, image is hashed while streaming, moved to store and linked to `path`.
+        Response validators are saved to state first, so interrupted download can be resumed.
+        Return dict with image `size` and `digest`.
+        '''
+        # server may ignore `Range` and send whole image, start from scratch then
+        resumed = (response.status == 206
+                   and response.headers.get('Content-Range', '').startswith(f'bytes {offset}-'))
+        if not resumed and response.status != 200:
+            # partial body of another range must not be saved as the whole image
+            raise ResponseStatusError(response.status, url)
+
+        validator = {
+            key: response.headers[key]
+            for key in ('ETag', 'Last-Modified')
+            if key in response.headers
+            }
+        if validator:
+            self.state.set_validator(url, validator)
+
+        hasher = None
+        if self.store is not None:
+            hasher = hashlib.sha256()
+            if resumed:
+                await self.writer.run(self._hash_file, part_path, hasher)
+
+        written = 0
+        try:
+            # body size is known from `Content-Length` unless it's chunked or compressed
+            async with self.writer.open(part_path, resumed, response.content_length) as file:
+                async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                    if hasher is not None:
+                        hasher.update(chunk)
+                    await file.write(chunk)
+                    written += len(chunk)
+        finally:
+            self.metrics.inc('response_bytes_total', written, phase='download')
+            self.tracker.add_bytes(written)
+
+        info = {'size': offset + written if resumed else written, 'written': written}
+        if self.store is not None:
+            info['digest'] = hasher.hexdigest()
+        await self._place_part(url, path, part_path, info)
+        return info
+
+
+    async def _finish_part(self, url: str, path: Path, part_path: Path, size: int) -> dict:
+        '''
+        Place `.part` file downloaded completely before at `path`, hashed for content store.
+        Return dict with image `size` and `digest`.
+        '''
+        info = {'size': size, 'written': 0}
+        if self.store is not None:
+            hasher = hashlib.sha256()
+            await self.writer.run(self._hash_file, part_path, hasher)
+            info['digest'] = hasher.hexdigest()
+        await self._place_part(url, path, part_path, info)
+        return info
+
+
+    async def _place_part(self, url: str, path: Path, part_path: Path, info: dict) -> None:
+        'Rename downloaded `.part` file to `path`, or move it to content store and link to `path`.'
+        if self.store is not None:
+            stored_path, size = await self.writer.run(self.store.add, part_path, info['digest'])
+            self.store.remember(url, info['digest'], size)
+            await self.writer.run(self.store.place, stored_path, path)
+        else:
+            await self.writer.run(os.replace, part_path, path)
+
+
+    def _hash_file(self, path: Path, hasher: object) -> None:
+        'Update `hasher` with file content at given path.'
+        with open(path, 'rb') as file:
+            while chunk := file.read(CHUNK_SIZE):
+                hasher.update(chunk)
+
+
+    def _get_task_limits(self) -> str:
+        'Return current concurrency and rate limits for task progress display.'
+        if self.pool is not None:
+            return f'{self.workers} workers x {self.concurrency} conn'
+        limits = f'{self.aimd.limit}/{self.aimd.maximum} conn'
+        if self.image_limiter.rate:
+            limits = f'{limits}, {self.image_limiter.rate:g} req/s'
+        return limits
+
+
+    def _get_sync_headers(self, validator: dict, path: Path, part_path: Path) -> tuple[dict, int]:
+        '''
+        Return conditional request headers and resume offset for the image
+        from its saved `validator` and files on disk, run on writer thread pool.\n
+        Partial `.part` file is resumed with `Range` request, guarded by `If-Range`
+        so changed image is downloaded from scratch. Existing image is revalidated
+        with `If-None-Match` or `If-Modified-Since`.
+        '''
+        # prefer strong ETag, server ignores `If-Range` with weak one
+        etag = validator.get('ETag')
+        if etag and etag.startswith('W/'):
+            etag = None
+
+        if part_path.exists() and (etag or 'Last-Modified' in validator):
+            offset = part_path.stat().st_size
+            headers = {
+                'Range': f'bytes={offset}-',
+                'If-Range': etag or validator['Last-Modified']
+                }
+            return headers, offset
+
+        if path.exists():
+            if 'ETag' in validator:
+                return {'If-None-Match': validator['ETag']}, 0
+            from email.utils import formatdate
+            last_modified = validator.get('Last-Modified') or formatdate(path.stat().st_mtime, usegmt=True)
+            return {'If-Modified-Since': last_modified}, 0
+
+        return {}, 0
+
+
+    def _get_downloaded(self, job_list: dict) -> set[tuple]:
+        '''
+        Return set of `(album_id, record, url)` tuples from given job list of previous versions
+        whose images exist on disk and are not partially downloaded.
         '''
-        Download image from given url to specified path,
-        updates progress task id with image filename.
+        downloaded = set()
+        for album in job_list['albums']:
+            album_path = Path.joinpath(Path(self.download_path), Path(self._get_album_dir(Album.from_dict(album))))
+            for record, url in album['records'].items():
+                path = Path.joinpath(album_path, Path(record.replace(' ', '_')))
+                if self._is_complete(path):
+                    downloaded.add((album['id'], record, url))
+
+        return downloaded
+
+
+    def _is_complete(self, path: Path) -> bool:
+        'Return `True` if image exists and is not partially downloaded.'
+        return path.exists() and not path.with_name(f'{path.name}.part').exists()
+
+
+    def _get_prefix(self) -> str:
+        '''
+        Return prefix of album folders and state files of the journal.
+        Variants other than original get their own folders and state,
+        so they never replace original images of the same records.
         '''
-        async with session.get(url) as response:
-            assert response.status == 200, f'{self.error_mark} {RESPONSE_NOT_200}'
-            data = await response.read()
+        if self.variant == 'original':
+            return f'lj_{self.username}'
+        return f'lj_{self.username}_{self.variant}'
 
-        async with aiofiles.open(path, 'wb') as file:
-            await file.write(data)
 
-        progress.update(task_id, filename=filename)
-        progress.update(task_id, advance=1)
+    def _get_album_dir(self, album: Album) -> str:
+        'Return album folder name.'
+        return f"{self._get_prefix()}_{album.id}__{album.name.replace(' ', '_')}"
 
 
     def _get_task_filename(self, record: str, width: int = 20) -> str:
@@ -441,61 +829,840 @@ class Ljdl():
         return filename
 
 
-    async def _json_dump(self, fp: Path, data: Sequence):
-        'Dump any sequence `data` to json file at given path.'
+    def _json_dump(self, fp: Path, data: Sequence):
+        'Dump any sequence `data` to json file at given path, blocking.'
         with open(fp, 'w', encoding='UTF-8') as file:
             json.dump(data, file, ensure_ascii=False, indent=4)
 
 
+    def _json_load(self, fp: Path, default: Sequence) -> Sequence:
+        'Load json file at given path, blocking. Return `default` if file is missing or broken.'
+        try:
+            with open(fp, 'r', encoding='UTF-8') as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return default
+
+
+    async def _albums_stage(self, albums: list[Album], album_queue: asyncio.Queue) -> None:
+        'Pipeline stage: put albums to `album_queue`, followed by `None` sentinel.'
+        for album in albums:
+            await album_queue.put(album)
+        await album_queue.put(None)
+
+
+    async def _records_stage(self, album_queue: asyncio.Queue, record_queue: asyncio.Queue) -> None:
+        '''
+        Pipeline stage: enumerate records of albums from `album_queue`
+        and put `(album, record)` tuples to `record_queue`.\n
+        Pages of all albums, planned from album `count`, are requested with `_get_records`
+        in batches of `RECORDS_BATCH_SIZE`, so a journal takes a few requests.
+        Full last page of an album is followed by the next one in the next batch,
+        as `count` may be outdated. Records of each album start with `(album, None)` marker,
+        stage ends with `None` sentinel.
+        '''
+        pages = deque()
+        albums_done = False
+        current = None
+
+        while True:
+            while not albums_done and len(pages) < RECORDS_BATCH_SIZE:
+                album = await album_queue.get()
+                if album is None:
+                    albums_done = True
+                else:
+                    pages.extend((album, offset) for offset in range(0, max(1, album.count), RECORDS_PAGE_SIZE))
+            if not pages:
+                break
+
+            batch = [pages.popleft() for _ in range(min(RECORDS_BATCH_SIZE, len(pages)))]
+            results = await self.retry.run(self._get_records, [(album.id, offset) for album, offset in batch])
+
+            following = []
+            for (album, offset), records in zip(batch, results):
+                if len(records) == RECORDS_PAGE_SIZE and offset + RECORDS_PAGE_SIZE >= album.count:
+                    following.append((album, offset + RECORDS_PAGE_SIZE))
+                # marker comes again if records of the album are continued after other albums
+                if album is not current:
+                    await record_queue.put((album, None))
+                    current = album
+                for record in records:
+                    self.metrics.observe('queue_depth', record_queue.qsize(), queue='records')
+                    await record_queue.put((album, record))
+            pages.extendleft(reversed(following))
+
+        await record_queue.put(None)
+
+
+    async def _normalize_stage(
+        self,
+        record_queue: asyncio.Queue,
+        download_queue: asyncio.Queue) -> tuple[int, int]:
+        '''
+        Pipeline stage: normalize image names of records from `record_queue`,
+        write them to state database and put download jobs to `download_queue`,
+        or to download plan with `largest_first`.
+        Skip images already downloaded in sync mode,
+        link images with urls known to content store without downloading.\n
+        Return tuple with total and skipped records count.
+        '''
+        records_seen = 0
+        skipped = 0
+
+        while (item := await record_queue.get()) is not None:
+            album, record = item
+            if record is None:
+                self.state.add_album(album.id, album.name, album.count, album.timecreate, self.variant)
+                album_path = Path.joinpath(Path(self.download_path), Path(self._get_album_dir(album)))
+                continue
+
+            image_name = self._get_image_name(record)
+            url = self._get_record_url(record)
+            path = Path.joinpath(album_path, Path(image_name))
+            records_seen += 1
+
+            if (self.sync
+                    and self.state.is_done(album.id, image_name, url)
+                    and await self.writer.run(self._is_complete, path)):
+                self.metrics.inc('images_total', result='skipped')
+                self._report(album.id, image_name, url, path, 'skipped')
+                skipped += 1
+                self.tracker.advance()
+                continue
+
+            self.state.add_record(album.id, image_name, url, *self._get_record_size(record))
+            stored_path = self.store.lookup(url) if self.store is not None else None
+            if stored_path is not None and await self.writer.run(self.store.place, stored_path, path):
+                self.state.set_done(album.id, image_name)
+                self.metrics.inc('images_total', result='linked')
+                self._report(album.id, image_name, url, path, 'linked')
+                skipped += 1
+                self.tracker.advance()
+                continue
+
+            if self.largest_first:
+                self.state.plan(id(self), album.id, image_name)
+                continue
+
+            self.metrics.observe('queue_depth', download_queue.qsize(), queue='download')
+            await download_queue.put((album.id, image_name, url, path))
+
+        return records_seen, skipped
+
+
+    async def _planned_stage(self, download_queue: asyncio.Queue, album_dirs: dict[int, Path]) -> None:
+        '''
+        Print estimated size of planned downloads and put planned jobs to `download_queue`,
+        largest first, to cut waiting for a few big images at the end of a run.
+        '''
+        from rich.filesize import decimal
+
+        count, known, size = self.state.get_plan_estimate(id(self))
+        if count and known:
+            # extrapolate average size of known ones to the rest
+            estimate = f'about {decimal(size + size // known * (count - known))}'
+        else:
+            estimate = 'unknown size'
+        self._echo(f"{self.label}Planned {self.colors.OK_GREEN}{count}{self.colors.ENDC} "
+                   f"images to download, {estimate}.")
+
+        for album_id, image_name, url in self.state.iter_planned(id(self)):
+            self.metrics.observe('queue_depth', download_queue.qsize(), queue='download')
+            await download_queue.put((album_id, image_name, url, Path.joinpath(album_dirs[album_id], image_name)))
+
+
+    async def _download_worker(self, queue: asyncio.Queue) -> None:
+        '''
+        Pipeline stage: take download jobs from `queue` one by one until cancelled.
+        Jobs failed after all retries are collected in `self.failed` instead of stopping the worker.
+        Record status is saved to state database.
+        '''
+        while True:
+            album_id, image_name, url, path = await queue.get()
+            started = time.monotonic()
+            try:
+                info = await self.retry.run(self._fetch_image, url, path, self.sync)
+                status = 'not_modified' if info is None else 'downloaded'
+                self.state.set_done(album_id, image_name, info)
+                self.metrics.inc('images_total', result=status)
+                self._report(album_id, image_name, url, path, status, info, time.monotonic() - started)
+                self.tracker.advance(image_name)
+            except Exception as ex:
+                self.metrics.inc('images_total', result='failed')
+                self.failed.append((url, path, ex))
+                self.state.set_failed(album_id, image_name, str(ex) or type(ex).__name__)
+                self._report(album_id, image_name, url, path, 'failed', None, time.monotonic() - started, ex)
+                self.tracker.advance()
+            finally:
+                queue.task_done()
+
+
+    def _worker_options(self) -> dict:
+        'Return `Ljdl` arguments for worker processes.'
+        return {
+            # site root, workers only download images
+            'url': f'{self.url_parse.scheme}://{self.url_parse.netloc}',
+            'path': str(self.download_path),
+            'concurrency': self.concurrency,
+            'limit_per_host': self.limit_per_host,
+            'retries': self.retry.attempts,
+            'rate_limit': self.image_limiter.rate / self.workers,
+            'store': str(self.store.root) if self.store is not None else None,
+            'fsync': self.writer.fsync
+            }
+
+
+    async def _submit_stage(self, download_queue: asyncio.Queue) -> None:
+        '''
+        Pipeline stage replacing download workers in multi-process mode:
+        send download jobs from `download_queue` to worker pool in batches of up to `WORKER_BATCH_SIZE`.
+        Jobs are marked done when their results come back.
+        '''
+        self.pool.register(id(self), lambda result: self._apply_result(download_queue, result))
+        while True:
+            jobs = [await download_queue.get()]
+            while len(jobs) < WORKER_BATCH_SIZE and not download_queue.empty():
+                jobs.append(download_queue.get_nowait())
+
+            await self.pool.submit(id(self), [
+                (*job, self.sync, self.state.get_validator(job[2]) if self.sync else None)
+                for job in jobs
+                ])
+
+
+    def _apply_result(self, download_queue: asyncio.Queue, result: tuple) -> None:
+        'Save result of download job done by worker process to state, progress and metrics.'
+        album_id, image_name, url, path, info, error, validator, retries, duration = result
+        self.retry.retries += retries
+        if validator:
+            self.state.set_validator(url, validator)
+
+        if error is None:
+            status = 'not_modified' if info is None else 'downloaded'
+            self.state.set_done(album_id, image_name, info)
+            self.metrics.inc('images_total', result=status)
+            if info is not None:
+                self.metrics.inc('response_bytes_total', info['written'], phase='download')
+                self.tracker.add_bytes(info['written'])
+            self._report(album_id, image_name, url, path, status, info, duration)
+            self.tracker.advance(image_name)
+        else:
+            ex = WorkerError(error)
+            self.metrics.inc('images_total', result='failed')
+            self.failed.append((url, path, ex))
+            self.state.set_failed(album_id, image_name, error)
+            self._report(album_id, image_name, url, path, 'failed', None, duration, ex)
+            self.tracker.advance()
+
+        download_queue.task_done()
+
+
+    def _report(
+        self,
+        album_id: int,
+        image_name: str,
+        url: str,
+        path: Path,
+        status: str,
+        info: Optional[dict] = None,
+        duration: float = 0.0,
+        error: Optional[Exception] = None) -> None:
+        'Pass result of a single image to `iter_downloads` consumer, if there is one.'
+        if self.results is not None:
+            size = info['written'] if info is not None else 0
+            self.results.put_nowait(DownloadResult(album_id, image_name, url, path, status, size, duration, error))
+
+
     async def download_images(self) -> None:
         '''
-        Gather list of async download tasks and start download process.
+        Run download pipeline: albums, records enumeration, image names normalization
+        and a fixed pool of download workers run as separate stages joined by bounded queues,
+        so images are downloaded while albums are still listed and memory stays flat
+        regardless of job list size. Status of every record is kept in SQLite state database,
+        job list json is exported from it when pipeline stops. All stages share single pooled session.
+        '''
+        await download_batch([self])
+
+
+    async def iter_downloads(self) -> AsyncIterator[DownloadResult]:
+        '''
+        Run download pipeline like `download_images`, without progress display,
+        and yield `DownloadResult` of each image as soon as it's done.
+        Errors stopping the whole download are raised, all of them but network errors
+        are subclasses of `LjdlError`.\n
+        Session and worker pool are opened for this run and closed after it,
+        unless this instance (or the one given as `share_with`) is used in `async with` block
+        or another run sharing them is still going on,
+        so any number of journals can be downloaded with one warm connection pool:\n
+        `async with Ljdl(url, verbose=False) as ljdl:`
+        `    async for result in Ljdl(other_url, verbose=False, share_with=ljdl).iter_downloads():`
         '''
-        semaphore = asyncio.BoundedSemaphore(5)
-        job_list = await self._generate_job_list()
+        async with self:
+            async for result in self._iter_downloads():
+                yield result
+
+
+    async def _iter_downloads(self) -> AsyncIterator[DownloadResult]:
+        'Run download pipeline in background task and yield results it puts to `self.results`.'
+        self.results = asyncio.Queue()
+        run = asyncio.create_task(self._download_images(QuietProgress()))
+        try:
+            while True:
+                result = asyncio.ensure_future(self.results.get())
+                try:
+                    await asyncio.wait((result, run), return_when=asyncio.FIRST_COMPLETED)
+                finally:
+                    # consumer may be cancelled meanwhile
+                    got = result.done()
+                    result.cancel()
+                if not got:
+                    break
+                yield result.result()
+
+            while not self.results.empty():
+                yield self.results.get_nowait()
+            # raise error which stopped the pipeline
+            run.result()
+        finally:
+            run.cancel()
+            await asyncio.gather(run, return_exceptions=True)
+            self.results = None
+
+
+    async def _download_images(self, progress: 'Progress') -> None:
+        self.failed = []
+        task_id = progress.add_task(
+            f'{self.label}Generating Job List...',
+            filename=' ... ',
+            limits=self._get_task_limits(),
+            bytes=0,
+            total=None
+            )
+        self.tracker = ProgressTracker(progress, task_id, self._get_task_filename, self._get_task_limits)
+        albums = await self._generate_job_list()
 
         job_list_path = Path.joinpath(
             Path(self.download_path),
-            Path(f"lj_{self.username}_job_list.json")
+            Path(f"{self._get_prefix()}_job_list.json")
+            )
+        state_path = Path.joinpath(
+            Path(self.download_path),
+            Path(f"{self._get_prefix()}_state.sqlite")
+            )
+        failed_path = Path.joinpath(
+            Path(self.download_path),
+            Path(f"{self._get_prefix()}_failed.json")
             )
-        await self._json_dump(job_list_path, job_list)
 
-        with progress:
-            task_id = progress.add_task('Downloading...', filename=' ... ')
+        album_dirs = {
+            album.id: Path.joinpath(Path(self.download_path), Path(self._get_album_dir(album)))
+            for album in albums
+            }
+        await self.writer.makedirs(album_dirs.values())
+
+        # released in `finally` below, nothing may fail in between
+        self.state = await self._open_state(state_path, job_list_path)
+        self.state.album_ids.extend(album.id for album in albums)
+
+        records_total = sum(album.count for album in albums)
+        # every stage runs at most one queue ahead of the next one,
+        # download jobs are put only when a worker is about to free up
+        album_queue = asyncio.Queue(maxsize=1)
+        record_queue = asyncio.Queue(maxsize=RECORDS_PAGE_SIZE)
+        download_queue = asyncio.Queue(maxsize=self.concurrency * 2)
+
+        progress.update(
+            task_id,
+            description=f"{self.label}{'Planning' if self.largest_first else 'Downloading'}...",
+            total=records_total
+            )
 
-            async with semaphore, aiohttp.ClientSession() as session:
-                tasks = []
+        if self.pool is not None:
+            workers = [asyncio.create_task(self._submit_stage(download_queue))]
+        else:
+            workers = [
+                asyncio.create_task(self._download_worker(download_queue))
+                for _ in range(self.concurrency)
+                ]
+        stages = [
+            asyncio.create_task(self._albums_stage(albums, album_queue)),
+            asyncio.create_task(self._records_stage(album_queue, record_queue)),
+            asyncio.create_task(self._normalize_stage(record_queue, download_queue))
+            ]
 
-                for album in job_list['albums']:
-                    album_dir = f"lj_{self.username}_{album['id']}__{album['name'].replace(' ', '_')}"
-                    album['download_path'] = Path.joinpath(Path(self.download_path), Path(album_dir))
-                    album_path = album['download_path']
-                    if not Path.exists(album_path):
-                        Path.mkdir(album_path, parents=True, exist_ok=True)
+        try:
+            with self.metrics.phase('download'):
+                try:
+                    # any failed stage cancels the whole pipeline
+                    _, _, (records_seen, skipped) = await asyncio.gather(*stages)
+                    # album 'count' may include records hidden from enumeration
+                    progress.update(task_id, total=records_seen)
+                    if self.largest_first:
+                        progress.update(task_id, description=f'{self.label}Downloading...')
+                        await self._planned_stage(download_queue, album_dirs)
+                    if self.pool is not None:
+                        await self.pool.join(download_queue)
+                    else:
+                        await download_queue.join()
+                finally:
+                    for task in (*stages, *workers):
+                        task.cancel()
+                    await asyncio.gather(*stages, *workers, return_exceptions=True)
+                    if self.pool is not None:
+                        self.pool.unregister(id(self))
+                    if self.largest_first:
+                        # plan is left if pipeline stopped before it was taken
+                        self.state.drop_plan(id(self))
+                    self.metrics.inc('retries_total', self.retry.retries, journal=self.username)
+                    self.tracker.flush()
+
+            progress.update(task_id, description=f'{self.label}Completed')
+            progress.update(task_id, filename='')
+
+            if skipped:
+                self._echo(f"{self.label}Skipped {self.colors.OK_GREEN}{skipped}{self.colors.ENDC} "
+                           f"already downloaded images.")
+
+            self._report_failed(records_seen)
+        finally:
+            await self._close_state(state_path, job_list_path, failed_path)
+
+
+    async def _open_state(self, path: Path, job_list_path: Path) -> StateStore:
+        '''
+        Return state database at given path, shared with instances made with `share_with`,
+        so albums of one journal downloaded at once use single connection: another one would
+        wait for SQLite lock blocking event loop. In sync mode, new database is filled
+        from job list json of previous versions on writer pool.
+        '''
+        owner = self._owner
+        path = path.resolve()
+        async with owner._state_lock:
+            if path not in owner._states:
+                state = StateStore(path)
+                if self.sync and state.created and job_list_path.exists():
+                    await self.writer.run(self._migrate_job_list, state, job_list_path)
+                owner._states[path] = state
+            owner._state_users[path] += 1
+            return owner._states[path]
 
-                    for record in album['records']:
-                        url = album['records'][record]
-                        path = Path.joinpath(
-                            Path(album['download_path']),
-                            Path(record.replace(' ', '_'))
-                            )
-                        filename = self._get_task_filename(record)
-                        tasks.append(
-                            asyncio.create_task(
-                                self._fetch_image(session, url, path, task_id, filename)
-                                ))
 
-                progress.update(task_id, total=len(tasks))
-                await asyncio.wait(tasks)
+    def _migrate_job_list(self, state: StateStore, job_list_path: Path) -> None:
+        'Fill new state database from job list json of previous versions, blocking.'
+        job_list = self._json_load(job_list_path, {'albums': []})
+        state.import_json(job_list, self._get_downloaded(job_list))
+
+
+    async def _close_state(self, path: Path, job_list_path: Path, failed_path: Path) -> None:
+        '''
+        Release state database at given path. Once the last download using it stops,
+        export job list json with albums of all of them on writer pool, dump retry manifest
+        with images failed in all of them or remove stale one, and close database.
+        '''
+        owner = self._owner
+        path = path.resolve()
+        # lock makes download reopening the database wait for export
+        async with owner._state_lock:
+            owner._state_users[path] -= 1
+            if owner._state_users[path]:
+                return
+
+            del owner._state_users[path]
+            state = owner._states.pop(path)
+            # job list json is kept for compatibility with external tools
+            state.commit()
+            await self.writer.run(state.export_json, job_list_path, state.album_ids)
+            if state.failed:
+                await self.writer.run(self._json_dump, failed_path, list(state.failed.values()))
+                self._echo(f'List of failed images saved to {failed_path}\n'
+                           f'Run again with --sync option to download only missing images.\n', error=True)
+            elif failed_path.exists():
+                await self.writer.run(failed_path.unlink, True)
+            state.close()
+
+
+    def _report_failed(self, records_total: int) -> None:
+        '''
+        Print report of images failed after all retries and add them to retry manifest
+        of the state database, dumped once all downloads using it stop.
+        '''
+        if not self.failed:
+            return
+
+        self._echo(f'{self.error_mark} {self.label}Failed to download '
+                   f'{len(self.failed)} of {records_total} images '
+                   f'({self.retry.retries} retries made):\n', error=True)
+
+        for url, path, ex in self.failed:
+            error = str(ex) or type(ex).__name__
+            self.state.failed[str(path)] = {'url': url, 'path': str(path), 'error': error}
+            self._echo(f'  {path.name}: {error}\n', error=True)
 
-                progress.update(task_id, description='Completed')
-                progress.update(task_id, filename='')
 
 
+async def download_batch(ljdls: List[Ljdl], journals: int = JOURNALS_DEFAULT) -> None:
+    '''
+    Download several journals concurrently, at most `journals` at once,
+    within single session and progress display. Failure of one journal
+    is reported and doesn't stop the others, `BatchError` is raised once all are done.
+    '''
+    if len(ljdls) > 1:
+        for ljdl in ljdls:
+            ljdl.label = f'{ljdl.username}: '
+
+    global progress
+    if progress is None:
+        progress = make_progress()
+
+    semaphore = asyncio.Semaphore(journals)
+
+    async def run(ljdl: Ljdl) -> None:
+        async with semaphore:
+            await ljdl._download_images(progress)
+
+    # instances created with `share_with` share the session and worker pool of the first one
+    async with ljdls[0]:
+        with progress:
+            results = await asyncio.gather(*(run(ljdl) for ljdl in ljdls), return_exceptions=True)
+
+    if len(ljdls) == 1 and isinstance(results[0], BaseException):
+        raise results[0]
+
+    failed = 0
+    for ljdl, result in zip(ljdls, results):
+        if isinstance(result, Exception):
+            failed += 1
+            sys.stderr.write(f'{ljdl.error_mark} {ljdl.label}{type(result).__name__}: {result}\n')
+    if failed:
+        raise BatchError(f'Failed to download {failed} of {len(ljdls)} journals.')
+
+
+async def serve(root: Ljdl, address: str, journals: int = JOURNALS_DEFAULT) -> None:
+    '''
+    Run download service on given address until interrupted,
+    jobs share session, worker pool and limits of `root` instance.
+    '''
+    # imported here: aiohttp web server is needed in this mode only
+    from server import DownloadServer
+
+    async with root:
+        await DownloadServer(root, journals).serve(address)
+
+
+def make_parser() -> 'argparse.ArgumentParser':
+    'Return command line arguments parser, built only when script is run.'
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='LJDL - Download image albums from livejournal.com.\n\n'
+                    'Usage: lj-dl-img [OPTIONS] [URL]',
+        formatter_class=argparse.RawTextHelpFormatter,
+        add_help=False
+        )
+
+    parser.add_argument(
+        'URL',
+        type=str,
+        nargs='*',
+        help='URL of Livejournal user or certain album to download. For example, specify: \n'
+             'https://username.livejournal.com - to download all avaliable albums.\n'
+             'https://username.livejournal.com/photo/album/1337 - to download just one certain album.\n'
+             'Several URLs may be specified to download them in one run.\n\n'
+        )
+
+    parser.add_argument(
+        '-h',
+        '--help',
+        action='help',
+        default=argparse.SUPPRESS,
+        help='Show this help message and exit.\n\n'
+        )
+
+    parser.add_argument(
+        '-v',
+        '--version',
+        action='version',
+        version=VERSION,
+        help='Show script version and exit.\n\n'
+        )
+
+    parser.add_argument(
+        '-d',
+        '--directory',
+        type=str,
+        metavar='',
+        help='Path where images should be downloaded.\n'
+             'Note that script will create a subfolder for each downloaded album.\n'
+             'Default: current working directory.\n\n'
+        )
+
+    parser.add_argument(
+        '-i',
+        '--input-file',
+        type=str,
+        metavar='',
+        help='Path to text file with URLs to download, one URL per line.\n'
+             'Empty lines and lines starting with # are ignored.\n\n'
+        )
+
+    parser.add_argument(
+        '-j',
+        '--journals',
+        type=int,
+        default=JOURNALS_DEFAULT,
+        metavar='',
+        help='Number of journals downloaded simultaneously when several URLs are given.\n'
+             'All of them share single session and --concurrency budget.\n'
+             f'Default: {JOURNALS_DEFAULT}.\n\n'
+        )
+
+    parser.add_argument(
+        '--serve',
+        type=str,
+        nargs='?',
+        const=SERVE_ADDRESS_DEFAULT,
+        metavar='',
+        help='Run as resident service accepting download jobs over local HTTP API\n'
+             'on host:port or unix:/path/to/socket address, keeping connections,\n'
+             'auth and user-agents warm between jobs. --journals jobs run at once,\n'
+             'sharing --concurrency budget evenly. Other options apply to all jobs.\n'
+             'Jobs are sent as JSON: POST /jobs {"url": URL, "sync": true},\n'
+             'status is given by GET /jobs, /jobs/ID, /stats and /metrics.\n'
+             f'Default address: {SERVE_ADDRESS_DEFAULT}.\n\n'
+        )
+
+    parser.add_argument(
+        '-c',
+        '--concurrency',
+        type=int,
+        default=CONCURRENCY_DEFAULT,
+        metavar='',
+        help='Maximum number of images downloaded simultaneously.\n'
+             'Actual number starts at half of it, grows while image host responds fast\n'
+             'and halves when it throttles requests.\n'
+             f'Default: {CONCURRENCY_DEFAULT}.\n\n'
+        )
+
+    parser.add_argument(
+        '-w',
+        '--workers',
+        type=int,
+        default=WORKERS_DEFAULT,
+        metavar='',
+        help='Number of processes downloading images, for multi-core hosts with fast links.\n'
+             'Albums are listed and images are scheduled by main process,\n'
+             'concurrency applies to each worker, rate limit is split between them.\n'
+             f'Default: {WORKERS_DEFAULT}.\n\n'
+        )
+
+    parser.add_argument(
+        '--limit-per-host',
+        type=int,
+        default=LIMIT_PER_HOST_DEFAULT,
+        metavar='',
+        help='Maximum number of simultaneous connections to a single image host.\n'
+             f'Default: {LIMIT_PER_HOST_DEFAULT}.\n\n'
+        )
+
+    parser.add_argument(
+        '--rate-limit',
+        type=float,
+        default=RATE_LIMIT_DEFAULT,
+        metavar='',
+        help='Maximum number of image requests per second to a single image host.\n'
+             'Default: 0 (unlimited).\n\n'
+        )
+
+    parser.add_argument(
+        '-s',
+        '--sync',
+        action='store_true',
+        help='Download only new or incomplete images.\n'
+             'Images downloaded by previous runs and present on disk are skipped,\n'
+             'partially downloaded images are resumed.\n\n'
+        )
+
+    parser.add_argument(
+        '--variant',
+        choices=VARIANTS,
+        default=VARIANT_DEFAULT,
+        metavar='',
+        help='Image size variant to download: original or preview\n'
+             f'(resized to {PREVIEW_SIZE}px by livejournal.com). Variant is saved in job list.\n'
+             'Preview images are saved to separate lj_<username>_preview_* folders.\n'
+             f'Default: {VARIANT_DEFAULT}.\n\n'
+        )
+
+    parser.add_argument(
+        '--largest-first',
+        action='store_true',
+        help='List all images before downloading, print estimated download size\n'
+             'and download largest images first, so the run doesn\'t end\n'
+             'waiting for a few big ones.\n\n'
+        )
+
+    parser.add_argument(
+        '--store',
+        type=str,
+        metavar='',
+        help='Path to content-addressed store folder shared by all downloads.\n'
+             'Each image is stored once and linked to album folders,\n'
+             'images with known urls are linked without downloading.\n\n'
+        )
+
+    parser.add_argument(
+        '--fsync',
+        action='store_true',
+        help='Flush each image to disk before it\'s moved into place.\n'
+             'Slower, but downloaded images survive power loss.\n\n'
+        )
+
+    parser.add_argument(
+        '-r',
+        '--retries',
+        type=int,
+        default=RETRY_ATTEMPTS,
+        metavar='',
+        help='Number of attempts for each request before giving up.\n'
+             'Connection errors, timeouts, 429 and 5xx responses are retried\n'
+             'with exponential backoff.\n'
+             f'Default: {RETRY_ATTEMPTS}.\n\n'
+        )
+
+    parser.add_argument(
+        '--metrics',
+        type=str,
+        metavar='',
+        help='Path to JSON file to write run metrics summary to at exit:\n'
+             'per-phase latency histograms, bytes per second, connection reuse\n'
+             'per host, retries and queue depth.\n\n'
+        )
+
+    parser.add_argument(
+        '--prometheus',
+        type=str,
+        metavar='',
+        help='Path to Prometheus text file to write run metrics to at exit.\n\n'
+        )
+
+    output = parser.add_mutually_exclusive_group()
+
+    output.add_argument(
+        '-q',
+        '--quiet',
+        action='store_true',
+        help='Don\'t show progress bars, only found, skipped and failed images summary.\n\n'
+        )
+
+    output.add_argument(
+        '--json-progress',
+        action='store_true',
+        help='Print progress as one JSON object per line instead of progress bars,\n'
+             'for headless runs and logs. Other messages are printed to stderr.\n\n'
+        )
+
+    return parser
+
+
+def read_urls(urls: List[str], input_file: Optional[str] = None) -> List[str]:
+    '''
+    Return URLs from command line followed by URLs from `input_file`, without duplicates.
+    Raise `ValueError` if file can't be read or no URLs are given.
+    '''
+    urls = list(urls)
+    if input_file:
+        try:
+            with open(input_file, 'r', encoding='UTF-8') as file:
+                for line in file:
+                    line = line.strip()
+                    if line and not line.startswith('#'):
+                        urls.append(line)
+        except OSError as ex:
+            raise ValueError(f"can't read input file: {ex}") from ex
+
+    if not urls:
+        raise ValueError('at least one URL or --input-file is required')
+
+    return list(dict.fromkeys(urls))
+
+
+def write_metrics(metrics: Metrics, json_path: Optional[str] = None, prometheus_path: Optional[str] = None) -> None:
+    'Write run metrics to JSON summary and Prometheus text files if paths are given.'
+    try:
+        if json_path:
+            metrics.write_json(Path(json_path))
+        if prometheus_path:
+            metrics.write_prometheus(Path(prometheus_path))
+    except OSError as ex:
+        sys.stderr.write(f"{TermColors.FAIL}●{TermColors.ENDC} Can't write metrics: {ex}\n")
+
 
 def main():
-    ljdl = Ljdl(url=args.URL, path=args.directory)
-    asyncio.run(ljdl.download_images())
+    global progress
+
+    parser = make_parser()
+    args = parser.parse_args()
+    try:
+        # service owns shared resources with site root instance, jobs come later
+        urls = [URL_SITE] if args.serve else read_urls(args.URL, args.input_file)
+    except ValueError as ex:
+        parser.error(str(ex))
+    if args.serve and (args.URL or args.input_file):
+        parser.error('URLs are sent to service as jobs, not with --serve')
+    if args.journals < 1:
+        parser.error(f"'journals' must be a positive integer, got {args.journals}")
+    if args.serve:
+        from server import parse_address
+        try:
+            parse_address(args.serve)
+        except ConfigError as ex:
+            parser.error(str(ex))
+
+    if args.quiet:
+        progress = make_progress('quiet')
+    elif args.json_progress:
+        progress = make_progress('json')
+
+    ljdls = []
+    for url in urls:
+        try:
+            ljdl = Ljdl(
+                url=url,
+                path=args.directory,
+                concurrency=args.concurrency,
+                limit_per_host=args.limit_per_host,
+                sync=args.sync,
+                retries=args.retries,
+                rate_limit=args.rate_limit,
+                store=args.store,
+                fsync=args.fsync,
+                workers=args.workers,
+                variant=args.variant,
+                largest_first=args.largest_first,
+                share_with=ljdls[0] if ljdls else None
+                )
+        except ConfigError as ex:
+            sys.stderr.write(f'{TermColors.FAIL}●{TermColors.ENDC} {str(ex).rstrip()}\n')
+            raise SystemExit(1)
+        ljdls.append(ljdl)
+
+    try:
+        if args.serve:
+            try:
+                asyncio.run(serve(ljdls[0], args.serve, args.journals))
+            except ConfigError as ex:
+                # address is taken or not permitted
+                parser.error(str(ex))
+        else:
+            asyncio.run(download_batch(ljdls, args.journals))
+    except LjdlError as ex:
+        sys.stderr.write(f'{TermColors.FAIL}●{TermColors.ENDC} {str(ex).rstrip()}\n')
+        raise SystemExit(1)
+    except KeyboardInterrupt:
+        if not args.serve:
+            raise
+    finally:
+        write_metrics(ljdls[0].metrics, args.metrics, args.prometheus)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,269 @@
+import json
+import os
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from types import SimpleNamespace
+from typing import TYPE_CHECKING, Iterator, Optional, Sequence
+
+from constants import METRICS_DEPTH_BUCKETS, METRICS_LATENCY_BUCKETS
+
+if TYPE_CHECKING:
+    import aiohttp
+
+PREFIX = 'ljdl_'
+
+
+def _number(value: float) -> str:
+    'Return value as Prometheus sample text without losing precision of big counters.'
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Histogram:
+    'Class for distribution of observed values over fixed buckets with count, sum, min and max.'
+
+    def __init__(self, buckets: Sequence[float] = METRICS_LATENCY_BUCKETS) -> None:
+        self.bounds = tuple(buckets)
+        self.counts = [0] * len(self.bounds)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+
+    def observe(self, value: float) -> None:
+        'Add value to histogram.'
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        for i, bound in enumerate(self.bounds):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+
+    def cumulative(self) -> Iterator[tuple[float, int]]:
+        'Yield `(upper_bound, count)` tuples with counts of values less than or equal to bound.'
+        total = 0
+        for bound, count in zip(self.bounds, self.counts):
+            total += count
+            yield bound, total
+
+
+    def quantile(self, q: float) -> Optional[float]:
+        'Return estimated quantile `q` as upper bound of the bucket it falls in, `max` if above all.'
+        if not self.count:
+            return None
+        rank = q * self.count
+        for bound, total in self.cumulative():
+            if total >= rank:
+                return min(bound, self.max)
+        return self.max
+
+
+    def summary(self) -> dict:
+        'Return dict with count, sum, min, max, mean and estimated quantiles.'
+        return {
+            'count': self.count,
+            'sum': round(self.sum, 6),
+            'min': self.min,
+            'max': self.max,
+            'mean': round(self.sum / self.count, 6) if self.count else None,
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            'p99': self.quantile(0.99),
+            }
+
+
+class Metrics:
+    '''
+    Class collecting run counters and histograms, shared by all downloads of a run.\n
+    HTTP requests are traced with `aiohttp.TraceConfig` hooks of the pooled session:
+    latency until response headers, status, errors and connection reuse per phase and host.
+    Phase of a request is passed as `trace_request_ctx={'phase': ...}`, wall time
+    of each phase is measured with `phase` context manager. Bodies read in chunks
+    with `iter_chunked` are not seen by hooks and are counted by caller with `inc`.\n
+    Collected values are written as JSON summary or Prometheus text exposition file.
+    '''
+
+    BUCKETS = {'queue_depth': METRICS_DEPTH_BUCKETS}
+
+    def __init__(self) -> None:
+        self.started = time.monotonic()
+        self.counters: dict[tuple, float] = {}
+        self.histograms: dict[tuple, Histogram] = {}
+        # first start and last end of each phase, concurrent downloads overlap
+        self.spans: dict[str, list[float]] = {}
+
+
+    def _key(self, name: str, labels: dict) -> tuple:
+        return name, tuple(sorted(labels.items()))
+
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        'Increase counter `name` with given labels by `value`.'
+        key = self._key(name, labels)
+        self.counters[key] = self.counters.get(key, 0) + value
+
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        'Add value to histogram `name` with given labels.'
+        key = self._key(name, labels)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram(self.BUCKETS.get(name, METRICS_LATENCY_BUCKETS))
+        histogram.observe(value)
+
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        'Measure wall time of the block as `phase_seconds` of phase `name`.'
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            ended = time.monotonic()
+            self.observe('phase_seconds', ended - started, phase=name)
+            span = self.spans.setdefault(name, [started, ended])
+            span[0] = min(span[0], started)
+            span[1] = max(span[1], ended)
+
+
+    def trace_config(self) -> 'aiohttp.TraceConfig':
+        'Return `aiohttp.TraceConfig` with hooks feeding this instance.'
+        import aiohttp
+
+        trace_config = aiohttp.TraceConfig(trace_config_ctx_factory=self._trace_ctx)
+        trace_config.on_request_start.append(self._on_request_start)
+        trace_config.on_request_end.append(self._on_request_end)
+        trace_config.on_request_exception.append(self._on_request_exception)
+        trace_config.on_response_chunk_received.append(self._on_response_chunk_received)
+        trace_config.on_connection_queued_start.append(self._on_connection_queued_start)
+        trace_config.on_connection_queued_end.append(self._on_connection_queued_end)
+        trace_config.on_connection_create_end.append(self._on_connection_create_end)
+        trace_config.on_connection_reuseconn.append(self._on_connection_reuseconn)
+        return trace_config
+
+
+    def _trace_ctx(self, trace_request_ctx: Optional[dict] = None) -> SimpleNamespace:
+        phase = (trace_request_ctx or {}).get('phase', 'other')
+        return SimpleNamespace(phase=phase, host='', started=0.0, queued=0.0)
+
+
+    async def _on_request_start(self, session, ctx, params) -> None:
+        ctx.host = params.url.host or ''
+        ctx.started = time.monotonic()
+
+
+    async def _on_request_end(self, session, ctx, params) -> None:
+        self.observe('request_seconds', time.monotonic() - ctx.started, phase=ctx.phase, host=ctx.host)
+        self.inc('requests_total', phase=ctx.phase, host=ctx.host, status=str(params.response.status))
+
+
+    async def _on_request_exception(self, session, ctx, params) -> None:
+        self.inc('request_errors_total', phase=ctx.phase, host=ctx.host, error=type(params.exception).__name__)
+
+
+    async def _on_response_chunk_received(self, session, ctx, params) -> None:
+        self.inc('response_bytes_total', len(params.chunk), phase=ctx.phase)
+
+
+    async def _on_connection_queued_start(self, session, ctx, params) -> None:
+        ctx.queued = time.monotonic()
+
+
+    async def _on_connection_queued_end(self, session, ctx, params) -> None:
+        self.observe('connection_wait_seconds', time.monotonic() - ctx.queued, phase=ctx.phase)
+
+
+    async def _on_connection_create_end(self, session, ctx, params) -> None:
+        self.inc('connections_created_total', host=ctx.host)
+
+
+    async def _on_connection_reuseconn(self, session, ctx, params) -> None:
+        self.inc('connections_reused_total', host=ctx.host)
+
+
+    def summary(self) -> dict:
+        'Return dict with all collected values, per-phase throughput and connection reuse ratio per host.'
+        counters = {}
+        for (name, labels), value in sorted(self.counters.items()):
+            counters.setdefault(name, []).append({'labels': dict(labels), 'value': value})
+
+        histograms = {}
+        for (name, labels), histogram in sorted(self.histograms.items(), key=lambda item: item[0]):
+            histograms.setdefault(name, []).append({'labels': dict(labels), **histogram.summary()})
+
+        bytes_per_second = {}
+        for (name, labels), value in self.counters.items():
+            phase = dict(labels).get('phase')
+            if name == 'response_bytes_total' and phase in self.spans:
+                started, ended = self.spans[phase]
+                if ended > started:
+                    bytes_per_second[phase] = round(value / (ended - started))
+
+        connection_reuse = {}
+        for (name, labels), value in self.counters.items():
+            if name == 'connections_reused_total':
+                host = dict(labels)['host']
+                created = self.counters.get(self._key('connections_created_total', {'host': host}), 0)
+                connection_reuse[host] = round(value / (value + created), 4)
+
+        return {
+            'elapsed_seconds': round(time.monotonic() - self.started, 3),
+            'bytes_per_second': bytes_per_second,
+            'connection_reuse': connection_reuse,
+            'counters': counters,
+            'histograms': histograms,
+            }
+
+
+    def prometheus(self) -> str:
+        'Return collected values in Prometheus text exposition format.'
+        lines = []
+
+        def labels_text(labels: Sequence[tuple], **extra) -> str:
+            pairs = [*labels, *extra.items()]
+            if not pairs:
+                return ''
+            escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"') for _, value in pairs)
+            return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + '}'
+
+        typed = set()
+        for (name, labels), value in sorted(self.counters.items()):
+            if name not in typed:
+                lines.append(f'# TYPE {PREFIX}{name} counter')
+                typed.add(name)
+            lines.append(f'{PREFIX}{name}{labels_text(labels)} {_number(value)}')
+
+        for (name, labels), histogram in sorted(self.histograms.items(), key=lambda item: item[0]):
+            if name not in typed:
+                lines.append(f'# TYPE {PREFIX}{name} histogram')
+                typed.add(name)
+            for bound, count in histogram.cumulative():
+                lines.append(f'{PREFIX}{name}_bucket{labels_text(labels, le=f"{bound:g}")} {count}')
+            lines.append(f'{PREFIX}{name}_bucket{labels_text(labels, le="+Inf")} {histogram.count}')
+            lines.append(f'{PREFIX}{name}_sum{labels_text(labels)} {_number(histogram.sum)}')
+            lines.append(f'{PREFIX}{name}_count{labels_text(labels)} {histogram.count}')
+
+        lines.append(f'# TYPE {PREFIX}elapsed_seconds gauge')
+        lines.append(f'{PREFIX}elapsed_seconds {_number(time.monotonic() - self.started)}')
+        return '\n'.join(lines) + '\n'
+
+
+    def _write(self, path: Path, text: str) -> None:
+        part_path = path.with_name(f'{path.name}.part')
+        with open(part_path, 'w', encoding='UTF-8') as file:
+            file.write(text)
+        os.replace(part_path, path)
+
+
+    def write_json(self, path: Path) -> None:
+        'Atomically write JSON summary to given path.'
+        self._write(Path(path), json.dumps(self.summary(), indent=4))
+
+
+    def write_prometheus(self, path: Path) -> None:
+        'Atomically write Prometheus text file to given path, e.g. for node_exporter textfile collector.'
+        self._write(Path(path), self.prometheus())
@@ -0,0 +1,121 @@
+import asyncio
+import time
+from types import TracebackType
+from typing import Optional, Type
+from urllib.parse import urlparse
+
+from constants import (AIMD_COOLDOWN, AIMD_LATENCY_FACTOR,
+                       RATE_LIMIT_BURST)
+
+
+class TokenBucket:
+    '''
+    Class for limiting requests rate: `rate` tokens per second
+    are added to the bucket holding at most `burst` tokens.
+    Each request takes one token, waiting for it if bucket is empty.
+    '''
+
+    def __init__(self, rate: float, burst: int = RATE_LIMIT_BURST) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+
+    async def acquire(self) -> None:
+        'Take one token, sleep until it is available.'
+        # lock keeps waiters in order, so each of them sleeps for its own token only
+        async with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+            if self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self.tokens = 1.0
+                self.updated = time.monotonic()
+
+            self.tokens -= 1
+
+
+class HostRateLimiter:
+    'Class holding separate `TokenBucket` for each host. Rate `0` disables limiting.'
+
+    def __init__(self, rate: float, burst: int = RATE_LIMIT_BURST) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.buckets = {}
+
+
+    async def acquire(self, url: str) -> None:
+        'Take one token from the bucket of `url` host.'
+        if not self.rate:
+            return
+
+        host = urlparse(url).netloc
+        if host not in self.buckets:
+            self.buckets[host] = TokenBucket(self.rate, self.burst)
+        await self.buckets[host].acquire()
+
+
+class AimdController:
+    '''
+    Class for adaptive concurrency limiting with additive increase / multiplicative decrease.\n
+    Used as async context manager around each request: limit grows by one after `limit`
+    successful requests with latency close to the best one seen, and halves on throttling
+    (`RETRY_STATUSES` responses, timeouts), at most once per `AIMD_COOLDOWN` seconds.
+    '''
+
+    def __init__(self, maximum: int, minimum: int = 1, start: Optional[int] = None) -> None:
+        self.maximum = maximum
+        self.minimum = minimum
+        self.limit = start or max(minimum, maximum // 2)
+        self.active = 0
+        self.latency_best = None
+        self._successes = 0
+        self._decreased = 0.0
+        self._condition = asyncio.Condition()
+
+
+    async def __aenter__(self) -> 'AimdController':
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.active < self.limit)
+            self.active += 1
+        return self
+
+
+    async def __aexit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc: Optional[BaseException],
+        tb: Optional[TracebackType]) -> None:
+        async with self._condition:
+            self.active -= 1
+            self._condition.notify_all()
+
+
+    def on_success(self, latency: float) -> None:
+        'Register successful request with given latency in seconds.'
+        if self.latency_best is None or latency < self.latency_best:
+            self.latency_best = latency
+
+        if latency > self.latency_best * AIMD_LATENCY_FACTOR:
+            self._successes = 0
+            return
+
+        self._successes += 1
+        if self._successes >= self.limit and self.limit < self.maximum:
+            self.limit += 1
+            self._successes = 0
+
+
+    def on_throttle(self) -> None:
+        'Register throttled or timed out request.'
+        now = time.monotonic()
+        if now - self._decreased < AIMD_COOLDOWN:
+            return
+
+        self.limit = max(self.minimum, self.limit // 2)
+        self._successes = 0
+        self._decreased = now
@@ -0,0 +1,105 @@
+from typing import Optional
+
+from constants import RECORD_PREVIEW_KEYS, RECORD_SIZE_KEYS
+
+_loads = None
+
+
+def decode_json(data: bytes) -> object:
+    '''
+    Decode JSON document from bytes. `orjson` parses API responses several times faster,
+    standard `json` is used if it isn't installed. Decoder is imported on first call,
+    not with this module, to keep cold start fast.
+    '''
+    global _loads
+
+    if _loads is None:
+        try:
+            from orjson import loads
+        except ImportError:
+            from json import loads
+        _loads = loads
+
+    return _loads(data)
+
+
+class Album:
+    '''
+    Class for album info from `photo.get_albums` API response,
+    keeps only fields used by download and state database.
+    '''
+
+    __slots__ = ('id', 'name', 'count', 'timecreate')
+
+    def __init__(self, id: int, name: str, count: int, timecreate: Optional[int] = None) -> None:
+        self.id = id
+        self.name = name
+        self.count = count
+        self.timecreate = timecreate
+
+
+    @classmethod
+    def from_dict(cls, album: dict) -> 'Album':
+        'Make album from API response or job list json dict.'
+        return cls(album['id'], album['name'], album['count'], album.get('timecreate'))
+
+
+class Record:
+    '''
+    Class for album record from `photo.get_records` API response.\n
+    Response dict is dropped right after parsing, only fields needed to name, plan
+    and download the image are kept: preview url from `RECORD_PREVIEW_KEYS`,
+    expected size in bytes from `RECORD_SIZE_KEYS` and pixels count, `None` if unknown.
+    '''
+
+    __slots__ = ('index', 'name', 'url', 'preview_url', 'size', 'pixels')
+
+    def __init__(
+        self,
+        index: int,
+        name: str,
+        url: str,
+        preview_url: Optional[str] = None,
+        size: Optional[int] = None,
+        pixels: Optional[int] = None) -> None:
+        self.index = index
+        self.name = name
+        self.url = url
+        self.preview_url = preview_url
+        self.size = size
+        self.pixels = pixels
+
+
+    @classmethod
+    def from_dict(cls, record: dict) -> 'Record':
+        'Make record from API response dict.'
+        preview_url = None
+        for key in RECORD_PREVIEW_KEYS:
+            if record.get(key):
+                preview_url = record[key]
+                break
+
+        size = None
+        for key in RECORD_SIZE_KEYS:
+            if isinstance(record.get(key), int) and record[key] > 0:
+                size = record[key]
+                break
+
+        pixels = None
+        width, height = record.get('width'), record.get('height')
+        if isinstance(width, int) and isinstance(height, int):
+            pixels = width * height
+
+        return cls(record['index'], record['name'], record['url'], preview_url, size, pixels)
+
+
+def get_suffix(path: str) -> str:
+    '''
+    Return extension of the last component of `path` or url with leading dot,
+    or empty string. Same as `PurePosixPath(path).suffix` without making path object.
+    '''
+    name = path.rstrip('/').rpartition('/')[2]
+    dot = name.rfind('.')
+    if 0 < dot < len(name) - 1:
+        return name[dot:]
+    return ''
@@ -0,0 +1,111 @@
+import asyncio
+import random
+import time
+from typing import (TYPE_CHECKING, Awaitable, Callable, Iterable, Optional,
+                    TypeVar)
+
+from constants import (RESPONSE_NOT_200, RETRY_ATTEMPTS, RETRY_BACKOFF,
+                       RETRY_BACKOFF_MAX, RETRY_STATUSES)
+from errors import LjdlError
+
+if TYPE_CHECKING:
+    import aiohttp
+
+T = TypeVar('T')
+
+
+class ResponseStatusError(LjdlError):
+    'Raised when server responds with unexpected status code.'
+
+    def __init__(self, status: int, url: str, retry_after: Optional[float] = None) -> None:
+        super().__init__(f'{RESPONSE_NOT_200}: {status} for {url}')
+        self.status = status
+        self.url = url
+        self.retry_after = retry_after
+
+    @property
+    def retryable(self) -> bool:
+        return self.status in RETRY_STATUSES
+
+
+class ApiError(LjdlError):
+    'Raised when JSON-RPC API responds with an error or without expected result.'
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    'Return `Retry-After` header value in seconds, it may be either seconds or HTTP-date.'
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    from email.utils import parsedate_to_datetime
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def check_status(response: 'aiohttp.ClientResponse', expected: Iterable[int] = (200,)) -> None:
+    'Raise `ResponseStatusError` if response status is not one of `expected`.'
+    if response.status not in expected:
+        raise ResponseStatusError(
+            response.status,
+            str(response.url),
+            parse_retry_after(response.headers.get('Retry-After'))
+            )
+
+
+class RetryPolicy:
+    '''
+    Class for retrying idempotent requests with exponential backoff and full jitter.\n
+    Only transient failures are retried: connection errors, timeouts, broken payloads
+    and `RETRY_STATUSES` responses. `Retry-After` header is respected for 429 and 503.
+    '''
+
+    def __init__(
+        self,
+        attempts: int = RETRY_ATTEMPTS,
+        backoff: float = RETRY_BACKOFF,
+        backoff_max: float = RETRY_BACKOFF_MAX) -> None:
+        self.attempts = attempts
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.retries = 0
+
+
+    def is_retryable(self, ex: BaseException) -> bool:
+        'Return `True` if exception is a transient failure worth retrying.'
+        if isinstance(ex, ResponseStatusError):
+            return ex.retryable
+
+        # already imported by the session which raised it
+        import aiohttp
+        return isinstance(ex, (aiohttp.ClientConnectionError,
+                               aiohttp.ClientPayloadError,
+                               asyncio.TimeoutError))
+
+
+    def delay(self, attempt: int, ex: BaseException) -> float:
+        'Return seconds to wait before next `attempt` (counted from 1).'
+        delay = random.uniform(0, min(self.backoff_max, self.backoff * 2 ** (attempt - 1)))
+        retry_after = getattr(ex, 'retry_after', None)
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.backoff_max))
+        return delay
+
+
+    async def run(self, func: Callable[..., Awaitable[T]], *args, **kwargs) -> T:
+        'Await `func(*args, **kwargs)` retrying transient failures. Last failure is re-raised.'
+        attempt = 1
+        while True:
+            try:
+                return await func(*args, **kwargs)
+            except Exception as ex:
+                if attempt >= self.attempts or not self.is_retryable(ex):
+                    raise
+                await asyncio.sleep(self.delay(attempt, ex))
+                attempt += 1
+                self.retries += 1
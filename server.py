@@ -0,0 +1,284 @@
+import asyncio
+import itertools
+import time
+from collections import Counter
+from pathlib import Path
+from typing import TYPE_CHECKING, Optional
+
+from aiohttp import web
+
+from constants import JOURNALS_DEFAULT, SERVE_JOBS_KEEP, TermColors
+from errors import ConfigError
+
+if TYPE_CHECKING:
+    from lj_dl_img import DownloadResult, Ljdl
+
+# job options accepted over API with their JSON types, the rest are set for the whole server
+JOB_OPTIONS = {'url': str, 'path': str, 'sync': bool, 'variant': str, 'largest_first': bool}
+
+
+def parse_address(address: str) -> tuple[str, Optional[int]]:
+    '''
+    Return `(host, port)` of TCP `host:port` address, host defaults to `localhost`,
+    or `(path, None)` of `unix:/path/to/socket` address. Raise `ConfigError` if it's invalid.
+    '''
+    if address.startswith('unix:'):
+        path = address[len('unix:'):]
+        if not path:
+            raise ConfigError(f'Service address {address!r} has no socket path.')
+        return path, None
+
+    host, _, port = address.rpartition(':')
+    if not port.isdigit() or not 0 < int(port) < 65536:
+        raise ConfigError(f'Service address {address!r} must be host:port or unix:/path/to/socket.')
+    return host or 'localhost', int(port)
+
+
+class Job:
+    'Class for a single journal download of `DownloadServer`, with its status and counters.'
+
+    def __init__(self, job_id: int, url: str, ljdl: 'Ljdl') -> None:
+        self.id = job_id
+        self.url = url
+        self.ljdl = ljdl
+        self.path = str(ljdl.download_path)
+        self.status = 'queued'
+        self.error = None
+        self.images = Counter()
+        self.bytes = 0
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.task = None
+
+
+    @property
+    def active(self) -> bool:
+        return self.status in ('queued', 'running')
+
+
+    def add(self, result: 'DownloadResult') -> None:
+        'Count result of a single image.'
+        self.images[result.status] += 1
+        self.bytes += result.size
+
+
+    def to_dict(self) -> dict:
+        'Return job status with throughput since its start, ready for JSON response.'
+        elapsed = None
+        if self.started is not None:
+            elapsed = (self.finished or time.time()) - self.started
+        return {
+            'id': self.id,
+            'url': self.url,
+            'path': self.path,
+            'status': self.status,
+            'error': self.error,
+            'images': dict(self.images),
+            'bytes': self.bytes,
+            'created': self.created,
+            'elapsed': round(elapsed, 3) if elapsed is not None else None,
+            'bytes_per_second': round(self.bytes / elapsed) if elapsed else None,
+            'images_per_second': round(sum(self.images.values()) / elapsed, 1) if elapsed else None
+            }
+
+
+class DownloadServer:
+    '''
+    Class for resident download service accepting journal download jobs over local HTTP API,
+    on TCP `host:port` or `unix:/path/to/socket` address.\n
+    Jobs are run with instances sharing session, worker pool, auth state, user-agent
+    and concurrency budget of `root`, so connections stay warm between jobs.
+    Job `path` is resolved relative to download path of `root` and must stay inside it.
+    At most `journals` jobs run at once, each with the same number of download workers
+    taking turns on the shared concurrency budget, so running jobs share it evenly.\n
+    API: `POST /jobs` with JSON object of `JOB_OPTIONS`, `GET /jobs`, `GET /jobs/{id}`,
+    `DELETE /jobs/{id}` to cancel, `GET /stats` with totals and `GET /metrics` in Prometheus format.
+    '''
+
+    def __init__(self, root: 'Ljdl', journals: int = JOURNALS_DEFAULT, keep: int = SERVE_JOBS_KEEP) -> None:
+        self.root = root
+        self.journals = journals
+        self.keep = keep
+        self.jobs = {}
+        self.images = Counter()
+        self.bytes = 0
+        self.started = time.time()
+        self._ids = itertools.count(1)
+        self._queue = None
+
+
+    def app(self) -> web.Application:
+        'Return aiohttp application with API routes.'
+        app = web.Application()
+        app.router.add_post('/jobs', self.submit)
+        app.router.add_get('/jobs', self.list_jobs)
+        app.router.add_get('/jobs/{id:\\d+}', self.get_job)
+        app.router.add_delete('/jobs/{id:\\d+}', self.cancel_job)
+        app.router.add_get('/stats', self.stats)
+        app.router.add_get('/metrics', self.metrics)
+        return app
+
+
+    async def serve(self, address: str) -> None:
+        '''
+        Listen on given address and run jobs until cancelled.
+        Raise `ConfigError` if address is invalid or can't be listened on.
+        '''
+        host, port = parse_address(address)
+        self._queue = asyncio.Queue()
+        runner = web.AppRunner(self.app(), access_log=None)
+        await runner.setup()
+        if port is None:
+            site = web.UnixSite(runner, host)
+        else:
+            site = web.TCPSite(runner, host, port)
+        try:
+            await site.start()
+        except OSError as ex:
+            await runner.cleanup()
+            raise ConfigError(f'Can\'t listen on {address}: {ex.strerror or ex}') from ex
+        print(f'Serving on {address}, {self.journals} jobs at once.')
+
+        runners = [asyncio.create_task(self._runner()) for _ in range(self.journals)]
+        try:
+            await asyncio.Future()
+        finally:
+            for task in runners:
+                task.cancel()
+            await asyncio.gather(*runners, return_exceptions=True)
+            await runner.cleanup()
+
+
+    async def _runner(self) -> None:
+        'Take jobs from queue one by one, cancelled jobs are skipped.'
+        while True:
+            job = await self._queue.get()
+            if job.status != 'queued':
+                continue
+            job.task = asyncio.create_task(self._run(job))
+            try:
+                await asyncio.shield(job.task)
+            except asyncio.CancelledError:
+                # server is stopping
+                job.task.cancel()
+                await asyncio.gather(job.task, return_exceptions=True)
+                raise
+
+
+    async def _run(self, job: Job) -> None:
+        'Download journal of the job, counting results of its images.'
+        job.status = 'running'
+        job.started = time.time()
+        try:
+            async for result in job.ljdl.iter_downloads():
+                job.add(result)
+                self.images[result.status] += 1
+                self.bytes += result.size
+        except asyncio.CancelledError:
+            job.status = 'cancelled'
+        except Exception as ex:
+            job.status = 'failed'
+            job.error = f'{type(ex).__name__}: {ex}'
+        else:
+            job.status = 'done'
+        finally:
+            job.finished = time.time()
+            job.ljdl = None
+            self._forget()
+
+        color = TermColors.OK_GREEN if job.status == 'done' else TermColors.FAIL
+        error = f', {job.error}' if job.error else ''
+        print(f"{color}●{TermColors.ENDC} Job {job.id} {job.status}: {job.url}, "
+              f"{job.images['downloaded']} downloaded, {job.images['failed']} failed{error}.")
+
+
+    def _forget(self) -> None:
+        'Drop oldest finished jobs above `keep` limit.'
+        finished = [job_id for job_id, job in self.jobs.items() if not job.active]
+        for job_id in finished[:max(0, len(finished) - self.keep)]:
+            del self.jobs[job_id]
+
+
+    def _get(self, request: web.Request) -> Job:
+        job = self.jobs.get(int(request.match_info['id']))
+        if job is None:
+            raise web.HTTPNotFound(text='Job not found.')
+        return job
+
+
+    async def submit(self, request: web.Request) -> web.Response:
+        'Validate job options, queue the job. Respond with its status.'
+        try:
+            options = await request.json()
+        except ValueError:
+            raise web.HTTPBadRequest(text='Request body must be a JSON object.')
+        if not isinstance(options, dict) or 'url' not in options:
+            raise web.HTTPBadRequest(text="Request body must be a JSON object with 'url'.")
+        unknown = set(options) - set(JOB_OPTIONS)
+        if unknown:
+            raise web.HTTPBadRequest(text=f"Unknown options: {', '.join(sorted(unknown))}.")
+        for key, value in options.items():
+            if not isinstance(value, JOB_OPTIONS[key]):
+                kind = 'a string' if JOB_OPTIONS[key] is str else 'true or false'
+                raise web.HTTPBadRequest(text=f"Option '{key}' must be {kind}.")
+
+        root_path = Path(self.root.download_path).resolve()
+        path = Path.joinpath(root_path, options.get('path', '')).resolve()
+        if path != root_path and root_path not in path.parents:
+            raise web.HTTPForbidden(text=f"Option 'path' must be inside {root_path}.")
+        options['path'] = str(path)
+
+        for job in self.jobs.values():
+            if job.active and job.url == options['url'] and Path(job.path) == Path(options['path']):
+                raise web.HTTPConflict(text=f'Same download is already queued as job {job.id}.')
+
+        try:
+            ljdl = type(self.root)(**options, verbose=False, share_with=self.root)
+        except (ConfigError, TypeError) as ex:
+            raise web.HTTPBadRequest(text=str(ex).strip())
+
+        job = Job(next(self._ids), options['url'], ljdl)
+        self.jobs[job.id] = job
+        self._queue.put_nowait(job)
+        return web.json_response(job.to_dict(), status=201)
+
+
+    async def list_jobs(self, request: web.Request) -> web.Response:
+        return web.json_response([job.to_dict() for job in self.jobs.values()])
+
+
+    async def get_job(self, request: web.Request) -> web.Response:
+        return web.json_response(self._get(request).to_dict())
+
+
+    async def cancel_job(self, request: web.Request) -> web.Response:
+        'Cancel queued or running job. Respond with its status.'
+        job = self._get(request)
+        if job.status == 'queued':
+            job.status = 'cancelled'
+            job.ljdl = None
+        elif job.status == 'running':
+            job.task.cancel()
+            await asyncio.gather(job.task, return_exceptions=True)
+        return web.json_response(job.to_dict())
+
+
+    async def stats(self, request: web.Request) -> web.Response:
+        'Respond with job counts and throughput of all jobs since server start.'
+        uptime = time.time() - self.started
+        return web.json_response({
+            'uptime': round(uptime, 3),
+            'jobs': dict(Counter(job.status for job in self.jobs.values())),
+            'images': dict(self.images),
+            'bytes': self.bytes,
+            'bytes_per_second': round(self.bytes / uptime),
+            'images_per_second': round(sum(self.images.values()) / uptime, 1),
+            'concurrency': self.root.aimd.limit,
+            'active': self.root.aimd.active
+            })
+
+
+    async def metrics(self, request: web.Request) -> web.Response:
+        'Respond with run metrics in Prometheus text format.'
+        return web.Response(text=self.root.metrics.prometheus(), content_type='text/plain')
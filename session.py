@@ -0,0 +1,92 @@
+from types import TracebackType
+from typing import TYPE_CHECKING, Optional, Sequence, Type
+
+from constants import (DNS_CACHE_TTL, KEEPALIVE_TIMEOUT, SOCK_CONNECT_TIMEOUT,
+                       SOCK_READ_TIMEOUT)
+
+if TYPE_CHECKING:
+    import aiohttp
+
+
+class SessionManager:
+    '''
+    Class owning single pooled `aiohttp.ClientSession` shared across
+    auth, API and image download phases.\n
+    Connections are kept alive and DNS lookups are cached between phases,
+    so each host costs one TCP connect and TLS handshake per pooled connection.
+    Headers and cookies are meant to be passed per request.
+    `aiohttp` is imported when session is opened, not with this module.
+    '''
+
+    def __init__(
+        self,
+        limit: int,
+        limit_per_host: int,
+        trace_configs: Optional[Sequence['aiohttp.TraceConfig']] = None) -> None:
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.trace_configs = list(trace_configs or ())
+        self._session = None
+
+
+    async def __aenter__(self) -> 'SessionManager':
+        self.open()
+        return self
+
+
+    async def __aexit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc: Optional[BaseException],
+        tb: Optional[TracebackType]) -> None:
+        await self.close()
+
+
+    @property
+    def session(self) -> 'aiohttp.ClientSession':
+        'Return opened `aiohttp.ClientSession`.'
+        assert self._session is not None, "Session is not opened, use 'async with' first."
+        return self._session
+
+
+    def open(self) -> None:
+        'Create pooled session, must be called inside running event loop.'
+        if self._session is not None and not self._session.closed:
+            return
+
+        import aiohttp
+
+        connector = aiohttp.TCPConnector(
+            limit=self.limit,
+            limit_per_host=self.limit_per_host,
+            keepalive_timeout=KEEPALIVE_TIMEOUT,
+            ttl_dns_cache=DNS_CACHE_TTL
+            )
+        # no total timeout, big images may take long, stalled sockets are caught instead
+        timeout = aiohttp.ClientTimeout(
+            total=None,
+            sock_connect=SOCK_CONNECT_TIMEOUT,
+            sock_read=SOCK_READ_TIMEOUT
+            )
+        self._session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=timeout,
+            trace_configs=self.trace_configs
+            )
+
+
+    async def close(self) -> None:
+        'Close session and all pooled connections.'
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+    def get(self, url: str, **kwargs) -> 'aiohttp.client._RequestContextManager':
+        'Make GET request with pooled session.'
+        return self.session.get(url, **kwargs)
+
+
+    def post(self, url: str, **kwargs) -> 'aiohttp.client._RequestContextManager':
+        'Make POST request with pooled session.'
+        return self.session.post(url, **kwargs)
@@ -0,0 +1,279 @@
+import sqlite3
+from pathlib import Path
+from typing import Iterable, Iterator, Optional
+
+from constants import STATE_COMMIT_EVERY
+from job_list import JobListWriter
+
+ALBUM_KEYS = ('count', 'timecreate', 'name', 'id')
+ADD_ALBUM = (
+    'INSERT INTO albums (id, name, count, timecreate, variant) VALUES (?, ?, ?, ?, ?) '
+    'ON CONFLICT (id) DO UPDATE SET '
+    'name = excluded.name, count = excluded.count, timecreate = excluded.timecreate, '
+    'variant = excluded.variant'
+    )
+ADD_RECORD = (
+    "INSERT INTO records (album_id, name, url, expected_size, pixels) VALUES (?, ?, ?, ?, ?) "
+    "ON CONFLICT (album_id, name) DO UPDATE SET "
+    "status = CASE WHEN url = excluded.url THEN status ELSE 'pending' END, "
+    "etag = CASE WHEN url = excluded.url THEN etag END, "
+    "last_modified = CASE WHEN url = excluded.url THEN last_modified END, "
+    "url = excluded.url, "
+    "expected_size = excluded.expected_size, "
+    "pixels = excluded.pixels"
+    )
+SET_DONE = "UPDATE records SET status = 'done', error = NULL WHERE album_id = ? AND name = ?"
+
+
+class StateStore:
+    '''
+    Class for SQLite state of journal albums and records, replacing monolithic job list json.\n
+    Each record keeps its download status (`pending`, `done` or `failed`), size, hash,
+    validators and last error, so interrupted or partial runs can be resumed.
+    Updates are committed in batches of `STATE_COMMIT_EVERY`, database runs in WAL mode.\n
+    Job list json import and export use their own connection, so they may run on another thread.\n
+    Records to download may be planned in temporary table first
+    and then taken largest first with `iter_planned`. Plans are kept per `owner` key,
+    as one database may be used by several downloads of the journal at once.
+    '''
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.created = not path.exists()
+        # albums downloaded with this connection, exported to job list json
+        self.album_ids = []
+        # retry manifest entries of images failed in downloads using this connection, by path
+        self.failed = {}
+        self._uncommitted = 0
+
+        self.db = sqlite3.connect(path)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS albums (
+                id INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                count INTEGER NOT NULL,
+                timecreate INTEGER,
+                variant TEXT
+            );
+            CREATE TABLE IF NOT EXISTS records (
+                album_id INTEGER NOT NULL,
+                name TEXT NOT NULL,
+                url TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                size INTEGER,
+                digest TEXT,
+                etag TEXT,
+                last_modified TEXT,
+                error TEXT,
+                expected_size INTEGER,
+                pixels INTEGER,
+                PRIMARY KEY (album_id, name)
+            );
+            CREATE INDEX IF NOT EXISTS records_url ON records (url);
+            DROP INDEX IF EXISTS records_status;
+            CREATE TEMP TABLE planned (
+                owner INTEGER NOT NULL,
+                album_id INTEGER NOT NULL,
+                name TEXT NOT NULL,
+                PRIMARY KEY (owner, album_id, name)
+            );
+            ''')
+        self.db.commit()
+
+
+    def _changed(self) -> None:
+        self._uncommitted += 1
+        if self._uncommitted >= STATE_COMMIT_EVERY:
+            self.commit()
+
+
+    def commit(self) -> None:
+        'Commit pending updates.'
+        self.db.commit()
+        self._uncommitted = 0
+
+
+    def close(self) -> None:
+        'Commit pending updates and close database.'
+        self.commit()
+        self.db.close()
+
+
+    def add_album(
+        self,
+        album_id: int,
+        name: str,
+        count: int,
+        timecreate: Optional[int] = None,
+        variant: Optional[str] = None) -> None:
+        'Insert or update album info along with image variant downloaded.'
+        self.db.execute(ADD_ALBUM, (album_id, name, count, timecreate, variant))
+        self._changed()
+
+
+    def add_record(
+        self,
+        album_id: int,
+        name: str,
+        url: str,
+        expected_size: Optional[int] = None,
+        pixels: Optional[int] = None) -> None:
+        '''
+        Insert record as pending, reset its state if url of existing record changed.
+        `expected_size` in bytes and `pixels` count are used to plan downloads.
+        '''
+        self.db.execute(ADD_RECORD, (album_id, name, url, expected_size, pixels))
+        self._changed()
+
+
+    def plan(self, owner: int, album_id: int, name: str) -> None:
+        'Add record to download plan of `owner` run.'
+        self.db.execute('INSERT OR IGNORE INTO planned VALUES (?, ?, ?)', (owner, album_id, name))
+        self._changed()
+
+
+    def get_plan_estimate(self, owner: int) -> tuple[int, int, int]:
+        'Return count of records planned by `owner`, count of those with known size and their total size.'
+        return self.db.execute(
+            'SELECT COUNT(*), COUNT(records.expected_size), COALESCE(SUM(records.expected_size), 0) '
+            'FROM planned JOIN records USING (album_id, name) WHERE owner = ?', (owner,)
+            ).fetchone()
+
+
+    def iter_planned(self, owner: int) -> Iterator[tuple]:
+        '''
+        Yield `(album_id, name, url)` of records planned by `owner`, largest first:
+        by expected size in bytes, then by pixels count, records of unknown size last.
+        Plan is dropped once iteration ends.
+        '''
+        self.commit()
+        # rows are sorted before the first one is returned,
+        # so records may be updated while iterating
+        rows = self.db.execute(
+            'SELECT album_id, name, url FROM planned JOIN records USING (album_id, name) '
+            'WHERE owner = ? '
+            'ORDER BY expected_size IS NULL, expected_size DESC, pixels IS NULL, pixels DESC, '
+            'records.rowid', (owner,)
+            )
+        try:
+            yield from rows
+        finally:
+            rows.close()
+            self.drop_plan(owner)
+
+
+    def drop_plan(self, owner: int) -> None:
+        'Remove download plan of `owner` run.'
+        self.db.execute('DELETE FROM planned WHERE owner = ?', (owner,))
+        self._changed()
+
+
+    def is_done(self, album_id: int, name: str, url: str) -> bool:
+        'Return `True` if record with the same url was downloaded before.'
+        row = self.db.execute(
+            'SELECT status FROM records WHERE album_id = ? AND name = ? AND url = ?',
+            (album_id, name, url)
+            ).fetchone()
+        return row is not None and row[0] == 'done'
+
+
+    def get_validator(self, url: str) -> dict:
+        'Return dict with `ETag` and `Last-Modified` response headers saved for url.'
+        row = self.db.execute(
+            'SELECT etag, last_modified FROM records WHERE url = ? LIMIT 1', (url,)
+            ).fetchone()
+        if row is None:
+            return {}
+        return {key: value for key, value in zip(('ETag', 'Last-Modified'), row) if value}
+
+
+    def set_validator(self, url: str, validator: dict) -> None:
+        'Save `ETag` and `Last-Modified` response headers for url, needed to resume partial download.'
+        self.db.execute(
+            'UPDATE records SET etag = ?, last_modified = ? WHERE url = ?',
+            (validator.get('ETag'), validator.get('Last-Modified'), url)
+            )
+        self._changed()
+
+
+    def set_done(self, album_id: int, name: str, info: Optional[dict] = None) -> None:
+        '''
+        Mark record as downloaded. `info` may contain `size` and `digest`,
+        missing `info` means image wasn't changed since last download.
+        '''
+        if info is None:
+            self.db.execute(SET_DONE, (album_id, name))
+        else:
+            self.db.execute(
+                "UPDATE records SET status = 'done', error = NULL, size = ?, digest = ? "
+                "WHERE album_id = ? AND name = ?",
+                (info.get('size'), info.get('digest'), album_id, name)
+                )
+        self._changed()
+
+
+    def set_failed(self, album_id: int, name: str, error: str) -> None:
+        'Mark record as failed with error description.'
+        self.db.execute(
+            "UPDATE records SET status = 'failed', error = ? WHERE album_id = ? AND name = ?",
+            (error, album_id, name)
+            )
+        self._changed()
+
+
+    def import_json(self, job_list: dict, downloaded: set[tuple]) -> None:
+        '''
+        Fill state from job list json of previous versions.
+        Records listed in `downloaded` set of `(album_id, name, url)` are marked as done.
+        Runs on its own connection, may be called from any thread.
+        '''
+        db = sqlite3.connect(self.path)
+        try:
+            with db:
+                for album in job_list['albums']:
+                    album_id = album['id']
+                    db.execute(ADD_ALBUM, (album_id, album['name'], album['count'], album.get('timecreate'), None))
+                    db.executemany(ADD_RECORD, (
+                        (album_id, name, url, None, None) for name, url in album['records'].items()
+                        ))
+                    db.executemany(SET_DONE, (
+                        (album_id, name) for name, url in album['records'].items()
+                        if (album_id, name, url) in downloaded
+                        ))
+        finally:
+            db.close()
+
+
+    def export_json(self, path: Path, album_ids: Iterable[int]) -> None:
+        '''
+        Export given albums with their records to job list json file of previous versions.
+        Runs on its own connection and may be called from any thread,
+        updates of this one must be committed first.
+        '''
+        db = sqlite3.connect(self.path)
+        try:
+            self._export_json(db, path, album_ids)
+        finally:
+            db.close()
+
+
+    def _export_json(self, db: sqlite3.Connection, path: Path, album_ids: Iterable[int]) -> None:
+        with JobListWriter(path) as job_list:
+            for album_id in dict.fromkeys(album_ids):
+                row = db.execute(
+                    f"SELECT {', '.join(ALBUM_KEYS)}, variant FROM albums WHERE id = ?", (album_id,)
+                    ).fetchone()
+                if row is None:
+                    continue
+
+                album = dict(zip(ALBUM_KEYS, row))
+                if row[-1] is not None:
+                    album['variant'] = row[-1]
+                job_list.add_album(album)
+                records = db.execute(
+                    'SELECT name, url FROM records WHERE album_id = ? ORDER BY rowid', (album_id,)
+                    )
+                for name, url in records:
+                    job_list.add_record(name, url)
@@ -0,0 +1,126 @@
+import os
+import shutil
+import sqlite3
+from pathlib import Path
+from typing import Optional
+
+from constants import FICLONE
+
+
+class ContentStore:
+    '''
+    Class for content-addressed store of downloaded images shared across albums and users.\n
+    Each image is kept once under `objects/<sha256[:2]>/<sha256>` and placed into album
+    folders with hardlink, reflink or copy, whichever filesystem supports first.
+    SQLite index maps record urls to hashes, so known urls are placed without any request.
+    Index is used on the thread which opened it, file operations may run on any thread.
+    '''
+
+    def __init__(self, root: Path) -> None:
+        self.root = Path(root)
+        self.objects = self.root / 'objects'
+        self.objects.mkdir(parents=True, exist_ok=True)
+        self.db = None
+        self.open()
+
+
+    def open(self) -> None:
+        'Open index database, if it is not opened yet or was closed.'
+        if self.db is not None:
+            return
+
+        self.db = sqlite3.connect(self.root / 'index.sqlite')
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS urls ('
+            'url TEXT PRIMARY KEY, '
+            'digest TEXT NOT NULL, '
+            'size INTEGER NOT NULL)'
+            )
+        self.db.commit()
+
+
+    def object_path(self, digest: str) -> Path:
+        'Return path of stored object by its sha256 hex digest.'
+        return self.objects / digest[:2] / digest
+
+
+    def lookup(self, url: str) -> Optional[Path]:
+        '''
+        Return path of stored object downloaded from `url` before, or `None`.
+        Object may be missing on disk if it was removed from store, see `place`.
+        '''
+        row = self.db.execute('SELECT digest FROM urls WHERE url = ?', (url,)).fetchone()
+        if row is None:
+            return None
+        return self.object_path(row[0])
+
+
+    def add(self, part_path: Path, digest: str) -> tuple[Path, int]:
+        '''
+        Move downloaded file into store, or drop it if the same content is already stored.
+        Return path of stored object and its size.
+        '''
+        path = self.object_path(digest)
+        size = part_path.stat().st_size
+
+        if path.exists():
+            part_path.unlink()
+        else:
+            path.parent.mkdir(exist_ok=True)
+            os.replace(part_path, path)
+
+        return path, size
+
+
+    def remember(self, url: str, digest: str, size: int) -> None:
+        'Save hash and size of object downloaded from `url` to index.'
+        self.db.execute('INSERT OR REPLACE INTO urls VALUES (?, ?, ?)', (url, digest, size))
+        self.db.commit()
+
+
+    def place(self, src: Path, dst: Path) -> bool:
+        '''
+        Place stored object `src` at `dst` replacing existing file: hardlink, reflink or copy.
+        Return `False` if `src` is missing.
+        '''
+        if not src.exists():
+            return False
+        if dst.exists() and os.path.samefile(src, dst):
+            return True
+
+        part_path = dst.with_name(f'{dst.name}.part')
+        if part_path.exists():
+            part_path.unlink()
+
+        try:
+            os.link(src, part_path)
+        except OSError:
+            try:
+                self._reflink(src, part_path)
+            except (OSError, ImportError):
+                shutil.copyfile(src, part_path)
+
+        os.replace(part_path, dst)
+        return True
+
+
+    def _reflink(self, src: Path, dst: Path) -> None:
+        'Make copy-on-write clone of `src` at `dst`, supported on Linux Btrfs/XFS only.'
+        import fcntl
+
+        with open(src, 'rb') as file_src, open(dst, 'wb') as file_dst:
+            try:
+                fcntl.ioctl(file_dst.fileno(), FICLONE, file_src.fileno())
+            except OSError:
+                file_dst.close()
+                dst.unlink()
+                raise
+
+
+    def close(self) -> None:
+        'Close index database, it may be opened again with `open`.'
+        if self.db is not None:
+            self.db.close()
+            self.db = None
@@ -2,15 +2,15 @@ import asyncio
 import itertools
 import json
 import random
+import threading
 from typing import Sequence
 from urllib.parse import urlparse
 
-import aiohttp
-from bs4 import BeautifulSoup
-
+import cache
 from constants import (BROWSER_FIELD_INCLUDE_PATTERNS,
                        OS_FIELD_EXCLUDE_PATTERNS, RESPONSE_NOT_200, UAS_BACKUP,
-                       URL_UAS, TermColors, headers_default)
+                       UAS_CACHE_NAME, UAS_CACHE_TTL, URL_UAS, TermColors,
+                       headers_default)
 
 
 class Ua:
@@ -22,6 +22,8 @@ class Ua:
         Fetch user-agent strings for specific `browser`.
         Return list of strings.
         '''
+        from bs4 import BeautifulSoup
+
         url = ''.join((URL_UAS, browser))
 
         async with session.get(url) as response:
@@ -49,6 +51,9 @@ class Ua:
         Gather results from `_get_uas` function.
         Return list with latest user-agent strings.
         '''
+        # imported only when cache is refreshed, not on every start
+        import aiohttp
+
         headers = dict(headers_default)
         del headers['Origin'], headers['Referer'], headers['Host'], headers['Connection']
         headers['Host'] = urlparse(URL_UAS).netloc
@@ -95,6 +100,7 @@ class Ua:
             return UAS_BACKUP
 
         uas_new_json = cls._json_dumps(uas_new)
+        cache.dump(UAS_CACHE_NAME, uas_new)
 
         if uas_backup_json != uas_new_json:
             return uas_new
@@ -102,11 +108,33 @@ class Ua:
             return UAS_BACKUP
 
 
+    @classmethod
+    def _refresh_cache(cls) -> None:
+        '''
+        Collect latest user-agent strings and store them in cache.
+        Failures are ignored, cache will be refreshed on the next run.
+        '''
+        try:
+            uas_new = asyncio.run(cls._gather_uas())
+        except Exception:
+            return
+
+        if uas_new:
+            cache.dump(UAS_CACHE_NAME, uas_new)
+
+
     @classmethod
     def random(cls) -> str:
-        'Return random chosen user-agent string.'
-        uas = cls._actualize_uas()
-        return random.choice(uas)
+        '''
+        Return random chosen user-agent string from cache without any network requests.\n
+        If cache is stale or missing, refresh it in background thread
+        and use stale cache or `UAS_BACKUP` meanwhile.
+        '''
+        uas, fresh = cache.load(UAS_CACHE_NAME, UAS_CACHE_TTL)
+        if not fresh:
+            threading.Thread(target=cls._refresh_cache, daemon=True).start()
+
+        return random.choice(uas or UAS_BACKUP)
 
 if __name__ == '__main__':
-    print(Ua.random())
\ No newline at end of file
+    print(random.choice(Ua._actualize_uas()))
\ No newline at end of file
@@ -0,0 +1,224 @@
+import asyncio
+import multiprocessing
+import queue
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import TracebackType
+from typing import Callable, Optional, Type
+
+from constants import PROGRESS_INTERVAL, WORKER_POLL_INTERVAL
+from display import ProgressTracker, QuietProgress
+from errors import LjdlError
+from retry import RetryPolicy
+
+
+class WorkerError(LjdlError):
+    'Image download failed in worker process, message is the original error.'
+
+
+class WorkerState:
+    '''
+    Class standing in for `StateStore` in worker process.
+    Validators come with download jobs and go back with results,
+    state database is written by main process only.
+    '''
+
+    def __init__(self) -> None:
+        self.validators = {}
+        self.received = {}
+
+
+    def get_validator(self, url: str) -> dict:
+        return self.validators.get(url) or {}
+
+
+    def set_validator(self, url: str, validator: dict) -> None:
+        self.received[url] = validator
+
+
+class WorkerPool:
+    '''
+    Class for pool of worker processes downloading images, each with its own
+    event loop, session, limits and disk writer, so download throughput isn't bound
+    to a single core.\n
+    Jobs are sent in batches of up to `WORKER_BATCH_SIZE` over a bounded queue shared
+    by all workers, results come back in batches at most every `PROGRESS_INTERVAL`
+    and are passed to handler registered by job owner in main process.
+    '''
+
+    def __init__(self, count: int, options: dict) -> None:
+        self.count = count
+        self.options = options
+        self.handlers = {}
+        self.crashed = None
+        self._context = multiprocessing.get_context('spawn')
+        self._jobs = None
+        self._results = None
+        self._processes = []
+        self._reader = None
+        self._closing = False
+        self._io = None
+
+
+    async def __aenter__(self) -> 'WorkerPool':
+        'Start worker processes, pool may be started again after exit.'
+        loop = asyncio.get_running_loop()
+        self.crashed = loop.create_future()
+        self._jobs = self._context.Queue(maxsize=self.count * 2)
+        self._results = self._context.Queue()
+        self._processes = []
+        self._closing = False
+        # blocking queue calls, one thread reads results while another submits jobs
+        self._io = ThreadPoolExecutor(max_workers=2, thread_name_prefix='ljdl-pool')
+        for _ in range(self.count):
+            process = self._context.Process(
+                target=worker_main,
+                args=(self.options, self._jobs, self._results),
+                daemon=True
+                )
+            process.start()
+            self._processes.append(process)
+        self._reader = asyncio.create_task(self._read())
+        return self
+
+
+    async def __aexit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc: Optional[BaseException],
+        tb: Optional[TracebackType]) -> None:
+        loop = asyncio.get_running_loop()
+        self._closing = True
+        if exc is None and not self.crashed.done():
+            for _ in self._processes:
+                await loop.run_in_executor(self._io, self._jobs.put, None)
+            for process in self._processes:
+                await loop.run_in_executor(None, process.join)
+        else:
+            for process in self._processes:
+                process.terminate()
+
+        self._reader.cancel()
+        await asyncio.gather(self._reader, return_exceptions=True)
+        self._io.shutdown(wait=False, cancel_futures=True)
+        if not self.crashed.done():
+            self.crashed.cancel()
+
+
+    def register(self, owner: int, handler: Callable[[tuple], None]) -> None:
+        'Register `handler` called with each result of jobs submitted by `owner`.'
+        self.handlers[owner] = handler
+
+
+    def unregister(self, owner: int) -> None:
+        'Forget handler of `owner` once its jobs are done.'
+        self.handlers.pop(owner, None)
+
+
+    async def submit(self, owner: int, jobs: list[tuple]) -> None:
+        'Send batch of `(album_id, image_name, url, path, sync, validator)` jobs to workers.'
+        batch = [(owner, *job) for job in jobs]
+        await asyncio.get_running_loop().run_in_executor(self._io, self._jobs.put, batch)
+
+
+    async def join(self, download_queue: asyncio.Queue) -> None:
+        'Wait until all jobs of `download_queue` are done, raise `WorkerError` if a worker died.'
+        done = asyncio.ensure_future(download_queue.join())
+        try:
+            await asyncio.wait((done, self.crashed), return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            # pipeline may be cancelled meanwhile
+            joined = done.done()
+            done.cancel()
+        if not joined:
+            self.crashed.result()
+
+
+    async def _read(self) -> None:
+        'Pass results to owner handlers, watch for workers exited unexpectedly.'
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                results = await loop.run_in_executor(
+                    self._io, self._results.get, True, WORKER_POLL_INTERVAL
+                    )
+            except queue.Empty:
+                dead = [process for process in self._processes if process.exitcode not in (None, 0)]
+                if dead and not self._closing and not self.crashed.done():
+                    self.crashed.set_exception(WorkerError(
+                        f'Worker process exited unexpectedly with code {dead[0].exitcode}.'
+                        ))
+                continue
+
+            for owner, *result in results:
+                # results of jobs cancelled with their pipeline may come after it stopped
+                handler = self.handlers.get(owner)
+                if handler is not None:
+                    handler(tuple(result))
+
+
+def worker_main(options: dict, jobs: multiprocessing.Queue, results: multiprocessing.Queue) -> None:
+    'Entry point of worker process.'
+    asyncio.run(_worker_run(options, jobs, results))
+
+
+async def _worker_run(options: dict, jobs: multiprocessing.Queue, results: multiprocessing.Queue) -> None:
+    # imported here: main module imports this one
+    from lj_dl_img import Ljdl
+
+    ljdl = Ljdl(**options)
+    ljdl.state = WorkerState()
+    ljdl.tracker = ProgressTracker(QuietProgress(), 0, str, str)
+
+    loop = asyncio.get_running_loop()
+    download_queue = asyncio.Queue(maxsize=ljdl.concurrency * 2)
+    reported = []
+
+    async def download() -> None:
+        while True:
+            owner, album_id, image_name, url, path, sync, validator = await download_queue.get()
+            ljdl.state.validators[url] = validator
+            info = error = None
+            # own policy per job to report its retries
+            retry = RetryPolicy(attempts=ljdl.retry.attempts)
+            started = time.monotonic()
+            try:
+                info = await retry.run(ljdl._fetch_image, url, path, sync)
+            except Exception as ex:
+                error = str(ex) or type(ex).__name__
+            finally:
+                ljdl.state.validators.pop(url, None)
+                received = ljdl.state.received.pop(url, None)
+                reported.append((
+                    owner, album_id, image_name, url, path, info, error, received, retry.retries,
+                    time.monotonic() - started
+                    ))
+                download_queue.task_done()
+
+    async def report() -> None:
+        while True:
+            await asyncio.sleep(PROGRESS_INTERVAL)
+            flush()
+
+    def flush() -> None:
+        if reported:
+            results.put(list(reported))
+            reported.clear()
+
+    async with ljdl.http:
+        tasks = [asyncio.create_task(download()) for _ in range(ljdl.concurrency)]
+        tasks.append(asyncio.create_task(report()))
+        try:
+            while (batch := await loop.run_in_executor(None, jobs.get)) is not None:
+                for job in batch:
+                    await download_queue.put(job)
+            await download_queue.join()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            flush()
+
+    if ljdl.store is not None:
+        ljdl.store.close()
+    ljdl.writer.close()
@@ -0,0 +1,163 @@
+import asyncio
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from types import TracebackType
+from typing import Callable, Iterable, Optional, Type, TypeVar
+
+from constants import FALLOC_FL_KEEP_SIZE, WRITE_BUFFER_SIZE, WRITER_THREADS
+
+T = TypeVar('T')
+
+_fallocate = None
+
+
+def preallocate(fd: int, offset: int, length: int) -> None:
+    '''
+    Reserve disk blocks for `length` bytes from `offset` without changing file size,
+    so interrupted download is still resumed from the real end of file.
+    Linux only, failures and other platforms are ignored.
+    '''
+    global _fallocate
+
+    if not sys.platform.startswith('linux') or length <= 0:
+        return
+    if _fallocate is None:
+        import ctypes
+
+        libc = ctypes.CDLL(None, use_errno=True)
+        _fallocate = libc.fallocate
+        _fallocate.argtypes = (ctypes.c_int, ctypes.c_int, ctypes.c_longlong, ctypes.c_longlong)
+        _fallocate.restype = ctypes.c_int
+
+    _fallocate(fd, FALLOC_FL_KEEP_SIZE, offset, length)
+
+
+class DiskWriter:
+    '''
+    Class for disk I/O off the event loop on a dedicated bounded thread pool,
+    so slow or network filesystems never stall network reads.\n
+    Files opened with `open` coalesce written chunks into `WRITE_BUFFER_SIZE` buffers,
+    with at most one buffer per file being written while the next one is filled.
+    With `fsync`, each file is flushed to disk before it's closed.
+    Thread pool is started on first use, so writer may be used again after `close`.
+    '''
+
+    def __init__(self, threads: int = WRITER_THREADS, fsync: bool = False) -> None:
+        self.threads = threads
+        self.fsync = fsync
+        self.executor = None
+
+
+    def run(self, func: Callable[..., T], *args) -> 'asyncio.Future[T]':
+        'Run `func(*args)` on writer thread pool. Return awaitable result.'
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix='ljdl-writer')
+        return asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+
+    async def makedirs(self, paths: Iterable[Path]) -> None:
+        '''
+        Create missing folders with single thread pool call.
+        Folders are checked on every call, they may be removed between downloads.
+        '''
+        paths = list(paths)
+
+        def makedirs() -> None:
+            for path in paths:
+                path.mkdir(parents=True, exist_ok=True)
+
+        await self.run(makedirs)
+
+
+    def open(self, path: Path, append: bool = False, size: Optional[int] = None) -> 'WriterFile':
+        '''
+        Return `WriterFile` to be used as async context manager.
+        Known body `size`, e.g. from `Content-Length`, is preallocated.
+        '''
+        return WriterFile(self, path, append, size)
+
+
+    def close(self) -> None:
+        'Wait for pending writes and stop thread pool.'
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+
+
+class WriterFile:
+    '''
+    Class for file written by `DiskWriter`. File is opened lazily with the first
+    buffer, so a small image costs single thread pool call to open, write and close.
+    Data received before an error is still written, so download can be resumed.
+    '''
+
+    def __init__(self, writer: DiskWriter, path: Path, append: bool, size: Optional[int]) -> None:
+        self.writer = writer
+        self.path = path
+        self.append = append
+        self.size = size
+        self._file = None
+        self._buffer = []
+        self._buffered = 0
+        self._pending = None
+
+
+    async def __aenter__(self) -> 'WriterFile':
+        return self
+
+
+    async def __aexit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc: Optional[BaseException],
+        tb: Optional[TracebackType]) -> None:
+        try:
+            await self._submit(self._close)
+            await self._pending
+        except OSError:
+            # previous buffer failed, `_close` wasn't submitted
+            if self._file is not None and not self._file.closed:
+                await self.writer.run(self._file.close)
+            if exc is None:
+                raise
+
+
+    async def write(self, chunk: bytes) -> None:
+        'Buffer chunk, pass buffer to writer thread once `WRITE_BUFFER_SIZE` is reached.'
+        self._buffer.append(chunk)
+        self._buffered += len(chunk)
+        if self._buffered >= WRITE_BUFFER_SIZE:
+            await self._submit(self._write)
+
+
+    async def _submit(self, func: Callable[[bytes], None]) -> None:
+        'Wait for previous buffer to be written to keep order, then submit current one.'
+        if self._pending is not None:
+            pending, self._pending = self._pending, None
+            await pending
+
+        data = b''.join(self._buffer)
+        self._buffer = []
+        self._buffered = 0
+        self._pending = self.writer.run(func, data)
+
+
+    def _write(self, data: bytes) -> None:
+        if self._file is None:
+            self._file = open(self.path, 'ab' if self.append else 'wb')
+            if self.size:
+                preallocate(self._file.fileno(), self._file.tell(), self.size)
+        self._file.write(data)
+
+
+    def _close(self, data: bytes) -> None:
+        try:
+            self._write(data)
+            if self.writer.fsync:
+                self._file.flush()
+                os.fsync(self._file.fileno())
+        finally:
+            if self._file is not None:
+                self._file.close()